@@ -0,0 +1,199 @@
+"""Columnar copy of the CSV dataset (one .npy file per column), memory-mapped.
+
+The CSV is converted once. Every process after that (and every uvicorn
+worker) only maps the files, so startup skips the CSV parse and the pages
+are shared through the OS page cache instead of being copied into each
+worker as Python strings.
+
+Integer columns are stored with the smallest integer dtype that holds them.
+Any other column is dictionary-encoded (codes + vocabulary). Either way
+`take()` returns exactly the strings that were in the CSV, and `take_json()`
+serializes the same rows straight from the columns.
+
+    python dataset.py ./data/covertype/covertype_train.csv   # convertir por adelantado
+"""
+import csv
+import fcntl
+import glob
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+from contextlib import contextmanager
+from functools import reduce
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+FORMAT_VERSION = 1
+_INT_TYPES = (np.int8, np.int16, np.int32, np.int64)
+_CODE_TYPES = (np.uint8, np.uint16, np.uint32)
+
+
+def _store_dir(csv_path: str) -> str:
+    # El nombre depende del CSV (tamaño y fecha): si el CSV cambia se genera otra copia
+    st = os.stat(csv_path)
+    key = hashlib.sha1(f"{FORMAT_VERSION}:{st.st_size}:{st.st_mtime_ns}".encode()).hexdigest()[:12]
+    return f"{os.path.splitext(csv_path)[0]}.{key}.columnar"
+
+
+def _smallest(arr: np.ndarray, types: Sequence[type]) -> np.ndarray:
+    lo, hi = (int(arr.min()), int(arr.max())) if arr.size else (0, 0)
+    for t in types:
+        info = np.iinfo(t)
+        if info.min <= lo and hi <= info.max:
+            return arr.astype(t)
+    return arr
+
+
+def _encode_column(values: List[str]) -> Tuple[str, np.ndarray, Optional[np.ndarray]]:
+    try:
+        ints = [int(v) for v in values]
+    except ValueError:
+        ints = None
+    # Solo si el texto vuelve idéntico ("007" o "+5" no lo harían)
+    if ints is not None and all(str(i) == v for i, v in zip(ints, values)):
+        return "int", _smallest(np.array(ints, dtype=np.int64), _INT_TYPES), None
+    vocab, codes = np.unique(np.array(values, dtype=str), return_inverse=True)
+    return "category", _smallest(codes, _CODE_TYPES), vocab
+
+
+def convert(csv_path: str, out_dir: str) -> None:
+    """Write the columnar store for `csv_path`; `out_dir` appears atomically (complete or not at all)."""
+    with open(csv_path, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, None) or []
+        columns: List[List[str]] = [[] for _ in header]
+        for line, row in enumerate(reader, start=2):
+            if len(row) != len(header):
+                raise ValueError(f"{csv_path}:{line}: expected {len(header)} fields, got {len(row)}")
+            for column, value in zip(columns, row):
+                column.append(value)
+
+    tmp = tempfile.mkdtemp(prefix=".columnar-", dir=os.path.dirname(os.path.abspath(out_dir)))
+    try:
+        meta = {"version": FORMAT_VERSION, "source": os.path.basename(csv_path),
+                "rows": len(columns[0]) if columns else 0, "columns": []}
+        for i, (name, values) in enumerate(zip(header, columns)):
+            kind, data, vocab = _encode_column(values)
+            entry = {"name": name, "kind": kind, "file": f"col_{i:03d}.npy", "dtype": data.dtype.str}
+            if kind == "int" and data.size:
+                entry.update(min=int(data.min()), max=int(data.max()))
+            np.save(os.path.join(tmp, entry["file"]), data)
+            if vocab is not None:
+                entry["vocab"] = f"col_{i:03d}.vocab.npy"
+                np.save(os.path.join(tmp, entry["vocab"]), vocab)
+            meta["columns"].append(entry)
+            columns[i] = []  # liberar memoria a medida que se escribe
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=2)
+        os.rename(tmp, out_dir)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+
+@contextmanager
+def _file_lock(path: str) -> Iterator[None]:
+    # Varios workers arrancan a la vez: solo uno convierte, el resto espera y mapea
+    with open(path, "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class ColumnarDataset:
+    """Read-only rows of a columnar store; columns are memory-mapped, not loaded."""
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        if meta.get("version") != FORMAT_VERSION:
+            raise ValueError(f"{path}: unsupported format version {meta.get('version')}")
+        self.path = path
+        self.header = [c["name"] for c in meta["columns"]]
+        self.rows = meta["rows"]
+        self._columns = [np.load(os.path.join(path, c["file"]), mmap_mode="r") for c in meta["columns"]]
+        # Los vocabularios son pequeños (categorías distintas): se cargan en memoria
+        self._vocabs = [np.load(os.path.join(path, c["vocab"])) if "vocab" in c else None
+                        for c in meta["columns"]]
+        self._meta = meta["columns"]
+        self._json_tokens: Optional[List[Tuple[Optional[np.ndarray], int]]] = None
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def take(self, indices: Sequence[int]) -> List[List[str]]:
+        """Rows at `indices`, in that order, as lists of the original CSV strings."""
+        idx = np.asarray(indices, dtype=np.intp)
+        columns = []
+        for data, vocab in zip(self._columns, self._vocabs):
+            part = data[idx]
+            columns.append(vocab[part].tolist() if vocab is not None else [str(v) for v in part.tolist()])
+        return [list(row) for row in zip(*columns)]
+
+    def _token_tables(self) -> List[Tuple[Optional[np.ndarray], int]]:
+        # Por columna: el texto JSON ('"valor"') de cada código o entero posible, más el desplazamiento
+        if self._json_tokens is None:
+            tables = []
+            for entry, data, vocab in zip(self._meta, self._columns, self._vocabs):
+                if vocab is not None:
+                    tables.append((np.array([json.dumps(v, ensure_ascii=False) for v in vocab.tolist()],
+                                            dtype=object), 0))
+                    continue
+                lo = entry.get("min", int(data.min()) if data.size else 0)
+                hi = entry.get("max", int(data.max()) if data.size else 0)
+                if hi - lo < 1 << 16:
+                    tables.append((np.array([f'"{v}"' for v in range(lo, hi + 1)], dtype=object), lo))
+                else:
+                    tables.append((None, 0))
+            self._json_tokens = tables
+        return self._json_tokens
+
+    def take_json(self, indices: Sequence[int]) -> str:
+        """Same rows as `take(indices)`, already encoded as a compact JSON array of arrays.
+
+        Each value is looked up in a per-column table of pre-encoded tokens and
+        rows are joined column-wise, so no per-row Python lists are built.
+        """
+        idx = np.asarray(indices, dtype=np.intp)
+        if not idx.size:
+            return "[]"
+        parts = []
+        for data, (table, offset) in zip(self._columns, self._token_tables()):
+            values = data[idx]
+            if table is None:
+                parts.append(np.char.add(np.char.add('"', values.astype(str)), '"').astype(object))
+            else:
+                parts.append(table[values.astype(np.intp) - offset])
+        rows = reduce(lambda acc, col: acc + "," + col, parts[1:], parts[0])
+        return "[[" + "],[".join(rows) + "]]"
+
+
+def load_dataset(csv_path: str) -> ColumnarDataset:
+    """Open the columnar store for `csv_path`, converting the CSV first if needed."""
+    if not os.path.isfile(csv_path):
+        # Sin CSV (p. ej. borrado para ahorrar espacio) sirve la última copia convertida
+        stores = sorted(glob.glob(f"{os.path.splitext(csv_path)[0]}.*.columnar"), key=os.path.getmtime)
+        if not stores:
+            raise FileNotFoundError(csv_path)
+        return ColumnarDataset(stores[-1])
+    out_dir = _store_dir(csv_path)
+    if not os.path.isdir(out_dir):
+        with _file_lock(f"{csv_path}.lock"):
+            if not os.path.isdir(out_dir):
+                convert(csv_path, out_dir)
+                for stale in glob.glob(f"{os.path.splitext(csv_path)[0]}.*.columnar"):
+                    if stale != out_dir:
+                        shutil.rmtree(stale, ignore_errors=True)
+    return ColumnarDataset(out_dir)
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        ds = load_dataset(path)
+        print(f"{path}: {len(ds)} rows -> {ds.path}")
@@ -1,14 +1,23 @@
 from fastapi import FastAPI, HTTPException, status
+from fastapi.responses import Response
 from pydantic import BaseModel
 from typing import Optional
-import random
 import requests
-import json
 import time
-import csv
 import os
+from functools import lru_cache
+
+import numpy as np
+
+from dataset import load_dataset
+from state import GroupState
 
 MIN_UPDATE_TIME = 30## 300 ## Aca pueden cambiar el tiempo minimo para cambiar bloque de información
+# Semilla opcional: con ella cada (grupo, lote) devuelve siempre la misma muestra (vacío = aleatorio)
+_data_seed = os.getenv("DATA_SEED", "").strip()
+if _data_seed and not _data_seed.isdigit():
+    raise ValueError(f"DATA_SEED debe ser un entero >= 0, no {_data_seed!r}")
+DATA_SEED = int(_data_seed) if _data_seed else None
 
 app = FastAPI()
 
@@ -70,59 +79,66 @@ if not os.path.isfile(_data_filepath):
     r = requests.get(url, allow_redirects=True, stream=True)
     open(_data_filepath, 'wb').write(r.content)
     
-data = []
-with open(_data_filepath, newline='') as csvfile:
-    reader = csv.reader(csvfile)
-    next(reader, None)
-    for row in reader:
-        data.append(row)
+# Copia columnar del CSV mapeada en memoria (se convierte una sola vez; los workers comparten páginas)
+data = load_dataset(_data_filepath)
 
 batch_size = len(data) // 10
 
-# Definir la función para generar la fracción de datos aleatoria
-def get_batch_data(batch_number:int, batch_size:int=batch_size):
+_rng = np.random.default_rng()
+
+# Índices aleatorios (sin repetición) dentro del rango del lote: no se copian filas
+def sample_indices(batch_number:int, batch_size:int=batch_size, rng:Optional[np.random.Generator]=None) -> np.ndarray:
     start_index = batch_number * batch_size
     end_index = start_index + batch_size
-    # Obtener datos aleatorios dentro del rango del grupo
-    random_data = random.sample(data[start_index:end_index], batch_size // 10)
-    return random_data
-
-# Cargar información previa si existe
-if os.path.isfile('/data/timestamps.json'):
-    with open('/data/timestamps.json', "r") as f:
-        timestamps = json.load(f)
-        
-else:
-    # Definir el diccionario para almacenar los timestamps de cada grupo e incializar el conteo, inicia en -1 para no agregar logica adicional de conteo
-    timestamps = {str(group_number): [0, -1] for group_number in range(1, 11)} # el valor está definido como [timestamp, batch]
+    # Mismo recorte que data[start_index:end_index], también con índices negativos o fuera de rango
+    rows = range(len(data))[start_index:end_index]
+    return rows.start + (rng or _rng).choice(len(rows), size=batch_size // 10, replace=False)
+
+@lru_cache(maxsize=256)
+def _seeded_batch_json(group_number:int, batch_number:int) -> str:
+    # Determinista por (semilla, grupo, lote): dentro de la misma ventana de tiempo se reutiliza sin recalcular
+    rng = np.random.default_rng([DATA_SEED, group_number, batch_number % 2**32])
+    return data.take_json(sample_indices(batch_number, rng=rng))
+
+def get_batch_json(group_number:int, batch_number:int) -> str:
+    if DATA_SEED is not None:
+        return _seeded_batch_json(group_number, batch_number)
+    return data.take_json(sample_indices(batch_number))
+
+# Estado [timestamp, batch] de cada grupo, compartido entre workers (SQLite); importa el JSON anterior una vez
+state = GroupState('/data/timestamps.db', groups=range(1, 11), legacy_json='/data/timestamps.json')
+
+@app.on_event("shutdown")
+def close_state():
+    state.close()
 
 # Definir la ruta de la API
 @app.get("/data")
 async def read_data(group_number: int):
-    global timestamps
-
     # Verificar si el número de grupo es válido
     if group_number < 1 or group_number > 10:
         raise HTTPException(status_code=400, detail="Número de grupo inválido")
-    # Verificar si el número de conteo es adecuado
-    if timestamps[str(group_number)][1] >= 10:
-        raise HTTPException(status_code=400, detail="Ya se recolectó toda la información minima necesaria")
-    
-    current_time = time.time()
-    last_update_time = timestamps[str(group_number)][0]
-    
-    # Verificar si han pasado más de 5 minutos desde la última actualización
-    if current_time - last_update_time > MIN_UPDATE_TIME: 
-        # Actualizar el timestamp y obtener nuevos datos
-        timestamps[str(group_number)][0] = current_time
-        timestamps[str(group_number)][1] += 1 #2 if timestamps[str(group_number)][1] == -1 else 1
-    
+
+    def advance(last_update_time: float, batch_number: int):
+        # Verificar si el número de conteo es adecuado
+        if batch_number >= 10:
+            raise HTTPException(status_code=400, detail="Ya se recolectó toda la información minima necesaria")
+        current_time = time.time()
+        # Verificar si han pasado más de 5 minutos desde la última actualización
+        if current_time - last_update_time > MIN_UPDATE_TIME:
+            # Actualizar el timestamp y obtener nuevos datos
+            return current_time, batch_number + 1
+        return last_update_time, batch_number
+
+    # Lectura y actualización en una sola transacción: dos requests simultáneos no avanzan el lote dos veces
+    _, batch_number = await state.update(group_number, advance)
+
     # Utilizar los mismos datos que la última vez (una parte del mismo grupo de información)
-    random_data = get_batch_data(timestamps[str(group_number)][1]) # cambio importante
-    with open('/data/timestamps.json', 'w') as file:
-        file.write(json.dumps(timestamps))
-    
-    return {"group_number": group_number, "batch_number": timestamps[str(group_number)][1], "data": random_data}
+    random_data = get_batch_json(group_number, batch_number) # cambio importante
+
+    # Las filas ya vienen serializadas desde las columnas: se arma el JSON sin listas intermedias
+    body = f'{{"group_number":{group_number},"batch_number":{batch_number},"data":{random_data}}}'
+    return Response(content=body, media_type="application/json")
 
 @app.get("/restart_data_generation")
 async def restart_data(group_number: int):
@@ -130,8 +146,5 @@ async def restart_data(group_number: int):
     if group_number < 1 or group_number > 10:
         raise HTTPException(status_code=400, detail="Número de grupo inválido")
 
-    timestamps[str(group_number)][0] = 0
-    timestamps[str(group_number)][1] = -1
-    with open('/data/timestamps.json', 'w') as file:
-        file.write(json.dumps(timestamps))
-    return {'ok'}
\ No newline at end of file
+    await state.update(group_number, lambda last_update_time, batch_number: (0, -1))
+    return {'ok'}
@@ -0,0 +1,102 @@
+"""Per-group [timestamp, batch] state of the data API, shared by every worker.
+
+The state lives in a SQLite database in WAL mode. Every read-modify-write is
+a single `BEGIN IMMEDIATE` transaction, so several uvicorn workers (or
+containers sharing /data) see the same counters and never lose an update.
+All database calls run on one background thread per process: the event loop
+never touches the file, and requests of the same process are applied one at
+a time in arrival order.
+
+A `timestamps.json` written by earlier versions is imported once, when the
+database is created.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+Update = Callable[[float, int], Tuple[float, int]]
+
+
+class GroupState:
+    """Async access to the [timestamp, batch] pair of each group."""
+
+    def __init__(self, db_path: str, groups: Iterable[int], legacy_json: Optional[str] = None):
+        self.db_path = db_path
+        self.groups = list(groups)
+        self.legacy_json = legacy_json
+        self._conn: Optional[sqlite3.Connection] = None
+        # Un solo hilo: la conexión no se comparte y las escrituras del proceso quedan en fila
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="group-state")
+        self._executor.submit(self._setup).result()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            # isolation_level=None: las transacciones se abren a mano con BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn = conn
+        return self._conn
+
+    def _setup(self) -> None:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS groups ("
+                         "group_number INTEGER PRIMARY KEY, timestamp REAL NOT NULL, batch INTEGER NOT NULL)")
+            if conn.execute("SELECT COUNT(*) FROM groups").fetchone()[0] == 0:
+                for group, (timestamp, batch) in self._legacy_rows().items():
+                    conn.execute("INSERT INTO groups VALUES (?, ?, ?)", (group, timestamp, batch))
+            # Inicia en -1 para no agregar logica adicional de conteo
+            conn.executemany("INSERT OR IGNORE INTO groups VALUES (?, 0, -1)", [(g,) for g in self.groups])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _legacy_rows(self) -> Dict[int, Tuple[float, int]]:
+        # Estado previo en JSON ({"1": [timestamp, batch], ...}), solo la primera vez
+        if not self.legacy_json or not os.path.isfile(self.legacy_json):
+            return {}
+        with open(self.legacy_json) as f:
+            legacy = json.load(f)
+        return {int(group): (float(value[0]), int(value[1])) for group, value in legacy.items()}
+
+    def _update(self, group: int, fn: Update) -> Tuple[float, int]:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT timestamp, batch FROM groups WHERE group_number = ?", (group,)).fetchone()
+            if row is None:
+                raise KeyError(group)
+            new = fn(row[0], row[1])
+            if tuple(new) != tuple(row):
+                conn.execute("UPDATE groups SET timestamp = ?, batch = ? WHERE group_number = ?",
+                             (new[0], new[1], group))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return new
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def update(self, group: int, fn: Update) -> Tuple[float, int]:
+        """Apply `fn(timestamp, batch) -> (timestamp, batch)` atomically and return the stored pair.
+
+        `fn` runs inside the transaction; if it raises, nothing is written
+        and the exception reaches the caller.
+        """
+        return await self._run(self._update, group, fn)
+
+    def close(self) -> None:
+        def _close():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        self._executor.submit(_close).result()
+        self._executor.shutdown()
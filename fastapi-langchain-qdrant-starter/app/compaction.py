@@ -0,0 +1,114 @@
+import asyncio
+import hashlib
+import logging
+from dataclasses import dataclass
+from typing import List, Sequence, Set, Tuple
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage, SystemMessage
+from langchain_core.prompts import ChatPromptTemplate
+from .history import aget_summary, aset_summary
+from .metrics import record_llm_usage
+from .tokens import count_tokens
+from . import settings
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = ChatPromptTemplate.from_messages([
+    ("system",
+     "Mantienes un resumen breve de una conversación entre un usuario y un asistente. "
+     "Actualiza el resumen con los mensajes nuevos conservando datos concretos "
+     "(productos, códigos, fechas, preferencias). Máximo {max_words} palabras. Devuelve solo el resumen."),
+    ("human", "Resumen actual:\n{summary}\n\nMensajes nuevos:\n{messages}")
+])
+
+# Overhead aproximado por mensaje (rol + separadores) en el formato de chat
+MESSAGE_OVERHEAD_TOKENS = 4
+
+@dataclass
+class CompactedHistory:
+    condense: List[BaseMessage]
+    answer: List[BaseMessage]
+
+def message_tokens(message: BaseMessage) -> int:
+    return count_tokens(str(message.content)) + MESSAGE_OVERHEAD_TOKENS
+
+def token_window(messages: Sequence[BaseMessage], budget: int) -> Tuple[List[BaseMessage], List[BaseMessage]]:
+    """Split into (older messages that don't fit, newest messages within `budget` tokens).
+
+    A budget <= 0 keeps the whole history.
+    """
+    if budget <= 0:
+        return [], list(messages)
+    used = 0
+    start = len(messages)
+    for i in range(len(messages) - 1, -1, -1):
+        used += message_tokens(messages[i])
+        if used > budget:
+            break
+        start = i
+    return list(messages[:start]), list(messages[start:])
+
+def fingerprint(message: BaseMessage) -> str:
+    return hashlib.sha1(f"{message.type}:{message.content}".encode()).hexdigest()
+
+def _with_summary(summary: str, dropped: List[BaseMessage], kept: List[BaseMessage]) -> List[BaseMessage]:
+    if summary and dropped:
+        return [SystemMessage(content=f"Resumen de la conversación anterior:\n{summary}")] + kept
+    return kept
+
+async def acompact(session_id: str, history: List[BaseMessage]) -> CompactedHistory:
+    """History for each prompt: a token-bounded window, prefixed by the rolling summary if any."""
+    summary = ""
+    if settings.HISTORY_SUMMARY_ENABLED:
+        summary, _ = await aget_summary(session_id)
+    c_dropped, c_kept = token_window(history, settings.CONDENSE_HISTORY_TOKENS)
+    a_dropped, a_kept = token_window(history, settings.ANSWER_HISTORY_TOKENS)
+    return CompactedHistory(
+        condense=_with_summary(summary, c_dropped, c_kept),
+        answer=_with_summary(summary, a_dropped, a_kept),
+    )
+
+def _unsummarized(dropped: List[BaseMessage], marker: str) -> List[BaseMessage]:
+    # El marcador es la huella del último mensaje ya resumido; si no aparece
+    # (el historial se recortó por delante) todo lo que queda es nuevo.
+    for i in range(len(dropped) - 1, -1, -1):
+        if fingerprint(dropped[i]) == marker:
+            return dropped[i + 1:]
+    return dropped
+
+async def aupdate_summary(llm: BaseChatModel, session_id: str, history: List[BaseMessage]) -> None:
+    """Fold messages that left the answer window into the session's summary."""
+    dropped, _ = token_window(history, settings.ANSWER_HISTORY_TOKENS)
+    if not dropped:
+        return
+    summary, marker = await aget_summary(session_id)
+    new = _unsummarized(dropped, marker)
+    if len(new) < settings.HISTORY_SUMMARY_MIN_MESSAGES:
+        return
+    text = "\n".join(f"{m.type}: {m.content}" for m in new)
+    prompt = SUMMARY_PROMPT.format_messages(
+        summary=summary or "(vacío)", messages=text, max_words=settings.HISTORY_SUMMARY_MAX_WORDS)
+    reply = await llm.ainvoke(prompt)
+    record_llm_usage("summary", prompt, reply)
+    await aset_summary(session_id, reply.content.strip(), fingerprint(new[-1]))
+
+_running: Set[str] = set()
+_tasks: Set[asyncio.Task] = set()
+
+def schedule_summary_update(llm: BaseChatModel, session_id: str, history: List[BaseMessage]) -> None:
+    """Run aupdate_summary in the background (at most one at a time per session)."""
+    if not settings.HISTORY_SUMMARY_ENABLED or session_id in _running:
+        return
+
+    async def run():
+        try:
+            await aupdate_summary(llm, session_id, history)
+        except Exception:
+            logger.exception("summary update failed for session %s", session_id)
+        finally:
+            _running.discard(session_id)
+
+    _running.add(session_id)
+    task = asyncio.ensure_future(run())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
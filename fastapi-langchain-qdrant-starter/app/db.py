@@ -1,17 +1,55 @@
 from contextlib import contextmanager
+from sqlalchemy import event
 from sqlmodel import SQLModel, create_engine, Session
 import os
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./data/chat_history.db")
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
 
-# Para SQLite: check_same_thread=False en URI si es necesario
-connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
+# Pool de conexiones (QueuePool). En SQLite en memoria SQLAlchemy usa su propio pool.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
 
-engine = create_engine(DATABASE_URL, echo=False, connect_args=connect_args)
+def _engine_kwargs() -> dict:
+    if IS_SQLITE:
+        kwargs = {
+            # check_same_thread=False: la conexión del pool puede usarse desde otro hilo
+            "connect_args": {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+        }
+        if ":memory:" not in DATABASE_URL and DATABASE_URL not in ("sqlite://", "sqlite:///"):
+            kwargs.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+        return kwargs
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+engine = create_engine(DATABASE_URL, echo=False, **_engine_kwargs())
+
+if IS_SQLITE:
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_connection, _record):
+        # WAL: los lectores no bloquean al escritor; NORMAL es seguro con WAL y evita un fsync por commit
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.close()
 
 def init_db():
-    from .models import ChatMessage, ChatSession  # noqa
+    from .models import ChatMessage, ChatSession, IngestManifest  # noqa
     SQLModel.metadata.create_all(engine)
+    # create_all no agrega índices nuevos a tablas ya existentes
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
 
 @contextmanager
 def get_session():
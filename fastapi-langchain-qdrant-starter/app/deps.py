@@ -1,22 +1,223 @@
-from qdrant_client import QdrantClient
+import asyncio
+import threading
+from typing import Any, Callable, Dict
+import httpx
+import redis
+import redis.asyncio as aioredis
+from qdrant_client import QdrantClient, AsyncQdrantClient
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
 from langchain_qdrant import QdrantVectorStore
+from .cache import TTLCache
+from .embedding_cache import CachedEmbeddings, SQLiteEmbeddingStore
+from .fakes import FakeChatModel, FakeEmbeddings
+from .gateway import Gateway, GatewayChatModel, GatewayEmbeddings, embedding_gateway, llm_gateway
 from . import settings
 
+# Contenedor de clientes del proceso: se crean una sola vez (startup o primer uso)
+# y se comparten entre requests para reutilizar pools HTTP con keep-alive.
+_clients: Dict[str, Any] = {}
+_lock = threading.RLock()  # reentrante: una factory puede pedir otros singletons
+
+def _singleton(name: str, factory: Callable[[], Any]) -> Any:
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = factory()
+    return client
+
+def existing_client(name: str) -> Any:
+    """The client registered as `name` if it was already created; never builds it."""
+    return _clients.get(name)
+
+def _http_limits(max_connections: int, max_keepalive: int) -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive,
+        keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+    )
+
+def _openai_limits() -> httpx.Limits:
+    return _http_limits(settings.HTTP_MAX_CONNECTIONS, settings.HTTP_MAX_KEEPALIVE_CONNECTIONS)
+
+def get_http_client() -> httpx.Client:
+    return _singleton("http", lambda: httpx.Client(limits=_openai_limits(), timeout=settings.HTTP_TIMEOUT))
+
+def get_async_http_client() -> httpx.AsyncClient:
+    return _singleton("http_async", lambda: httpx.AsyncClient(limits=_openai_limits(), timeout=settings.HTTP_TIMEOUT))
+
+class _LocalQdrant:
+    """Local (in-process) Qdrant client with calls serialized by a lock.
+
+    Local mode is not thread-safe and keeps data per client instance, so the
+    sync and async getters share this one client (ingest runs in threads).
+    """
+
+    def __init__(self, client: QdrantClient):
+        self._client = client
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            with self._lock:
+                return attr(*args, **kwargs)
+        return call
+
+class _AsyncLocalQdrant:
+    """AsyncQdrantClient-like view of a `_LocalQdrant`: each call runs in a worker thread."""
+
+    def __init__(self, local: _LocalQdrant):
+        self._local = local
+
+    def __getattr__(self, name: str) -> Any:
+        call = getattr(self._local, name)
+
+        async def acall(*args, **kwargs):
+            return await asyncio.to_thread(call, *args, **kwargs)
+        return acall
+
+def _local_qdrant() -> _LocalQdrant:
+    location = settings.QDRANT_LOCATION
+    return _singleton("qdrant_local", lambda: _LocalQdrant(
+        QdrantClient(location=location) if location == ":memory:" else QdrantClient(path=location)))
+
 def get_qdrant_client() -> QdrantClient:
-    return QdrantClient(host=settings.QDRANT_HOST, port=settings.QDRANT_PORT)
+    if settings.QDRANT_LOCATION:
+        return _local_qdrant()
+    return _singleton("qdrant", lambda: QdrantClient(
+        host=settings.QDRANT_HOST,
+        port=settings.QDRANT_PORT,
+        timeout=settings.QDRANT_TIMEOUT,
+        limits=_http_limits(settings.QDRANT_MAX_CONNECTIONS, settings.QDRANT_MAX_CONNECTIONS),
+    ))
+
+def get_async_qdrant_client() -> AsyncQdrantClient:
+    if settings.QDRANT_LOCATION:
+        return _singleton("qdrant_async", lambda: _AsyncLocalQdrant(_local_qdrant()))
+    return _singleton("qdrant_async", lambda: AsyncQdrantClient(
+        host=settings.QDRANT_HOST,
+        port=settings.QDRANT_PORT,
+        timeout=settings.QDRANT_TIMEOUT,
+        limits=_http_limits(settings.QDRANT_MAX_CONNECTIONS, settings.QDRANT_MAX_CONNECTIONS),
+    ))
+
+def get_redis_pool() -> redis.ConnectionPool:
+    return _singleton("redis", lambda: redis.ConnectionPool.from_url(
+        settings.REDIS_URL, max_connections=settings.REDIS_MAX_CONNECTIONS))
+
+def get_async_redis_pool() -> aioredis.ConnectionPool:
+    return _singleton("redis_async", lambda: aioredis.ConnectionPool.from_url(
+        settings.REDIS_URL, max_connections=settings.REDIS_MAX_CONNECTIONS))
+
+def get_embedding_store() -> SQLiteEmbeddingStore | None:
+    if not settings.EMBEDDING_CACHE_PATH:
+        return None
+    return _singleton("embedding_store", lambda: SQLiteEmbeddingStore(settings.EMBEDDING_CACHE_PATH))
+
+# Con el gateway activo los reintentos (con jitter) son suyos: el SDK no reintenta por su cuenta
+def _sdk_retries() -> int:
+    return 0 if settings.LLM_GATEWAY else 2
+
+def get_llm_gateway() -> Gateway:
+    return _singleton("llm_gateway", llm_gateway)
 
-def get_embeddings() -> OpenAIEmbeddings:
-    return OpenAIEmbeddings(model=settings.EMBEDDING_MODEL, api_key=settings.OPENAI_API_KEY)
+def get_embedding_gateway() -> Gateway:
+    return _singleton("embedding_gateway", embedding_gateway)
 
-def get_llm() -> ChatOpenAI:
-    return ChatOpenAI(model=settings.OPENAI_MODEL, temperature=0, api_key=settings.OPENAI_API_KEY)
+def _embedding_provider() -> tuple[Embeddings, str]:
+    if settings.EMBEDDING_PROVIDER == "fake":
+        # El nombre separa sus vectores de los reales en la caché en disco
+        fake = FakeEmbeddings(dim=settings.FAKE_EMBEDDING_DIM, latency=settings.FAKE_EMBEDDING_LATENCY)
+        return fake, f"fake-{settings.FAKE_EMBEDDING_DIM}"
+    return OpenAIEmbeddings(
+        model=settings.EMBEDDING_MODEL,
+        api_key=settings.OPENAI_API_KEY,
+        max_retries=_sdk_retries(),
+        http_client=get_http_client(),
+        http_async_client=get_async_http_client(),
+    ), settings.EMBEDDING_MODEL
+
+def get_embeddings() -> CachedEmbeddings:
+    def build() -> CachedEmbeddings:
+        underlying, model = _embedding_provider()
+        if settings.LLM_GATEWAY:
+            # Detrás de la caché: solo lo que no está cacheado consume cuota
+            underlying = GatewayEmbeddings(underlying, get_embedding_gateway())
+        return CachedEmbeddings(
+            underlying,
+            model=model,
+            store=get_embedding_store(),
+            query_cache=TTLCache(settings.QUERY_EMBEDDING_CACHE_SIZE, settings.QUERY_EMBEDDING_CACHE_TTL),
+        )
+    return _singleton("embeddings", build)
+
+def _chat_provider() -> BaseChatModel:
+    if settings.LLM_PROVIDER == "fake":
+        return FakeChatModel(
+            latency=settings.FAKE_LLM_LATENCY,
+            token_latency=settings.FAKE_LLM_TOKEN_LATENCY,
+            reply_tokens=settings.FAKE_LLM_REPLY_TOKENS,
+        )
+    return ChatOpenAI(
+        model=settings.OPENAI_MODEL,
+        temperature=0,
+        api_key=settings.OPENAI_API_KEY,
+        max_retries=_sdk_retries(),
+        stream_usage=True,  # uso de tokens también en /chat/stream (métricas)
+        http_client=get_http_client(),
+        http_async_client=get_async_http_client(),
+    )
+
+def get_llm() -> BaseChatModel:
+    def build() -> BaseChatModel:
+        llm = _chat_provider()
+        if not settings.LLM_GATEWAY:
+            return llm
+        return GatewayChatModel(inner=llm, gateway=get_llm_gateway(),
+                                expected_completion_tokens=settings.LLM_EXPECTED_COMPLETION_TOKENS)
+    return _singleton("llm", build)
 
 def get_vector_store() -> QdrantVectorStore:
-    client = get_qdrant_client()
-    embeddings = get_embeddings()
-    return QdrantVectorStore(
-        client=client,
+    # Se crea de forma perezosa: QdrantVectorStore valida que la colección exista,
+    # y antes del primer /ingest puede no existir todavía.
+    return _singleton("vector_store", lambda: QdrantVectorStore(
+        client=get_qdrant_client(),
         collection_name=settings.QDRANT_COLLECTION,
-        embedding=embeddings,
-    )
+        embedding=get_embeddings(),
+    ))
+
+def init_clients() -> None:
+    """Build the shared clients eagerly so the first request doesn't pay for it."""
+    get_qdrant_client()
+    get_async_qdrant_client()
+    get_embeddings()
+    get_llm()
+
+async def close_clients() -> None:
+    """Close pooled connections and drop the singletons (app shutdown)."""
+    with _lock:
+        clients = dict(_clients)
+        _clients.clear()
+    if "qdrant" in clients:
+        clients["qdrant"].close()
+    if "qdrant_async" in clients and "qdrant_local" not in clients:
+        await clients["qdrant_async"].close()
+    if "qdrant_local" in clients:
+        clients["qdrant_local"].close()
+    if "embedding_store" in clients:
+        clients["embedding_store"].close()
+    if "redis" in clients:
+        clients["redis"].disconnect()
+    if "redis_async" in clients:
+        await clients["redis_async"].disconnect()
+    if "http" in clients:
+        clients["http"].close()
+    if "http_async" in clients:
+        await clients["http_async"].aclose()
@@ -0,0 +1,124 @@
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from .cache import TTLCache
+
+# Dimensión conocida de los modelos de OpenAI: evita la llamada "dim-probe"
+KNOWN_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class SQLiteEmbeddingStore:
+    """On-disk vectors keyed by (model, sha256 of the text)."""
+
+    def __init__(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, hash TEXT NOT NULL, dim INTEGER NOT NULL, vector BLOB NOT NULL,"
+            " PRIMARY KEY (model, hash))"
+        )
+        self._conn.commit()
+
+    def mget(self, model: str, hashes: List[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            # SQLite limita los parámetros por consulta: troceamos
+            for i in range(0, len(hashes), 500):
+                part = hashes[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({','.join('?' * len(part))})",
+                    [model, *part],
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def mset(self, model: str, items: Iterable[Tuple[str, List[float]]]) -> None:
+        rows = [(model, h, len(v), np.asarray(v, dtype=np.float32).tobytes()) for h, v in items]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+    def dimension(self, model: str) -> Optional[int]:
+        with self._lock:
+            row = self._conn.execute("SELECT dim FROM embeddings WHERE model = ? LIMIT 1", (model,)).fetchone()
+        return row[0] if row else None
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only calls the provider for unseen texts.
+
+    Document (chunk) vectors go to `store` on disk, query vectors to an
+    in-memory LRU/TTL cache; both are namespaced by `model`.
+    """
+
+    def __init__(self, underlying: Embeddings, model: str, store: Optional[SQLiteEmbeddingStore], query_cache: TTLCache):
+        self.underlying = underlying
+        self.model = model
+        self.store = store
+        self.query_cache = query_cache
+
+    def _split(self, texts: List[str]) -> Tuple[List[str], Dict[str, List[float]], List[str]]:
+        hashes = [content_hash(t) for t in texts]
+        found = self.store.mget(self.model, hashes) if self.store else {}
+        missing = list({h: t for h, t in zip(hashes, texts) if h not in found}.items())
+        return hashes, found, missing
+
+    def _merge(self, hashes, found, missing, vectors) -> List[List[float]]:
+        new = [(h, v) for (h, _), v in zip(missing, vectors)]
+        if self.store and new:
+            self.store.mset(self.model, new)
+        found.update(new)
+        return [found[h] for h in hashes]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes, found, missing = self._split(texts)
+        vectors = self.underlying.embed_documents([t for _, t in missing]) if missing else []
+        return self._merge(hashes, found, missing, vectors)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes, found, missing = await asyncio.to_thread(self._split, texts)
+        vectors = await self.underlying.aembed_documents([t for _, t in missing]) if missing else []
+        return await asyncio.to_thread(self._merge, hashes, found, missing, vectors)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = (self.model, content_hash(text))
+        vector = self.query_cache.get(key)
+        if vector is None:
+            vector = self.underlying.embed_query(text)
+            self.query_cache.set(key, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = (self.model, content_hash(text))
+        vector = self.query_cache.get(key)
+        if vector is None:
+            vector = await self.underlying.aembed_query(text)
+            self.query_cache.set(key, vector)
+        return vector
+
+    def dimension(self) -> int:
+        """Vector size: known-model table, then the cache, and only then a live probe."""
+        dim = KNOWN_DIMENSIONS.get(self.model)
+        if dim is None and self.store:
+            dim = self.store.dimension(self.model)
+        if dim is None:
+            dim = len(self.embed_query("dim-probe"))
+        return dim
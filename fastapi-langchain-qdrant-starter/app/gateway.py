@@ -0,0 +1,353 @@
+import asyncio
+import copy
+import hashlib
+import json
+import random
+import threading
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+import httpx
+import openai
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from .metrics import GATEWAY_EVENTS
+from .tokens import count_tokens
+from . import settings
+
+T = TypeVar("T")
+
+class RateLimited(Exception):
+    """The call would exceed the configured budget; retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after: float, reason: str):
+        super().__init__(f"{reason}, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """Requests/min and tokens/min budgets, refilled continuously (0 = unlimited).
+
+    A call reserves its share up front and sleeps until the budget covers it,
+    so waiting callers are served in arrival order. Calls that would wait more
+    than `max_wait`, or arrive with `max_waiters` already waiting, are refused.
+    """
+
+    def __init__(self, rpm: int, tpm: int, max_waiters: int, max_wait: Optional[float]):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_waiters = max_waiters
+        self.max_wait = max_wait
+        self.waiting = 0
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed, self._updated = now - self._updated, now
+        if self.rpm:
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    def _reserve(self, tokens: int, block: bool) -> float:
+        with self._lock:
+            self._refill()
+            # Una llamada mayor que el límite por minuto no debe esperar para siempre
+            tokens = min(tokens, self.tpm) if self.tpm else tokens
+            wait = 0.0
+            if self.rpm:
+                wait = max(wait, (1 - self._requests) * 60 / self.rpm)
+            if self.tpm:
+                wait = max(wait, (tokens - self._tokens) * 60 / self.tpm)
+            if wait > 0 and not block:
+                if self.max_wait is not None and wait > self.max_wait:
+                    raise RateLimited(wait, "rate limit")
+                if self.max_waiters and self.waiting >= self.max_waiters:
+                    raise RateLimited(wait, "too many queued calls")
+            if self.rpm:
+                self._requests -= 1
+            if self.tpm:
+                self._tokens -= tokens
+            if wait > 0:
+                self.waiting += 1
+            return wait
+
+    def _done_waiting(self) -> None:
+        with self._lock:
+            self.waiting -= 1
+
+    async def acquire(self, tokens: int, block: bool = False) -> None:
+        wait = self._reserve(tokens, block)
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self._done_waiting()
+
+    def acquire_sync(self, tokens: int) -> None:
+        # Solo desde hilos de fondo (ingesta): espera lo necesario en vez de rechazar
+        wait = self._reserve(tokens, block=True)
+        if wait > 0:
+            try:
+                time.sleep(wait)
+            finally:
+                self._done_waiting()
+
+    def settle(self, estimated: int, actual: int) -> None:
+        """Correct a reservation once the provider reports the real token usage."""
+        if not self.tpm:
+            return
+        with self._lock:
+            self._tokens = min(self.tpm, self._tokens + estimated - actual)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._refill()
+            return {"rpm": self.rpm, "tpm": self.tpm, "waiting": self.waiting,
+                    "available_requests": round(self._requests, 2) if self.rpm else None,
+                    "available_tokens": round(self._tokens) if self.tpm else None}
+
+class SingleFlight:
+    """Identical concurrent calls share one upstream call and its result.
+
+    The shared call runs as its own task, so a caller that gives up (client
+    disconnect) does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        task = self._calls.get(key)
+        shared = task is not None
+        if task is None:
+            task = self._calls[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task), shared
+
+    def _done(self, key: str, task: asyncio.Task) -> None:
+        self._calls.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # marcada como recuperada aunque nadie siga esperando
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+_TRANSIENT = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError,
+              openai.InternalServerError, httpx.TransportError)
+
+def _retry_after(exc: BaseException) -> float:
+    response = getattr(exc, "response", None)
+    try:
+        return float(response.headers.get("retry-after", 0)) if response is not None else 0.0
+    except ValueError:
+        return 0.0
+
+class Gateway:
+    """Budget, de-duplication and retries for one upstream (LLM or embeddings)."""
+
+    def __init__(self, name: str, rpm: int, tpm: int, max_waiters: int, max_wait: Optional[float],
+                 max_retries: int, retry_base: float, retry_max: float):
+        self.name = name
+        self.bucket = TokenBucket(rpm, tpm, max_waiters, max_wait)
+        self.flights = SingleFlight()
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.counts = {"calls": 0, "coalesced": 0, "rejected": 0, "retries": 0}
+
+    def _count(self, event: str, n: int = 1) -> None:
+        self.counts[event] += n
+        GATEWAY_EVENTS.labels(self.name, event).inc(n)
+
+    def _backoff(self, attempt: int, exc: BaseException) -> float:
+        # Full jitter: los reintentos de muchos requests no llegan todos a la vez
+        delay = random.uniform(0, min(self.retry_max, self.retry_base * 2 ** attempt))
+        return max(delay, _retry_after(exc))
+
+    def _give_up(self, attempt: int, exc: BaseException) -> bool:
+        if isinstance(exc, _TRANSIENT) and attempt < self.max_retries:
+            self._count("retries")
+            return False
+        return True
+
+    def _upstream_limited(self, exc: BaseException) -> RateLimited:
+        return RateLimited(_retry_after(exc) or self.retry_max, "upstream rate limit")
+
+    async def call(self, key: Optional[str], tokens: int, fn: Callable[[], Awaitable[T]]) -> T:
+        """Run `fn` within budget; calls with the same `key` in flight share one result."""
+        if key is None:
+            return await self._call(tokens, fn)
+        result, shared = await self.flights.do(key, lambda: self._call(tokens, fn))
+        if shared:
+            # Copia propia: LangChain puede anotar el resultado (ids de run) de cada llamante
+            self._count("coalesced")
+            result = copy.deepcopy(result)
+        return result
+
+    async def acquire(self, tokens: int, block: bool = False) -> None:
+        try:
+            await self.bucket.acquire(tokens, block)
+        except RateLimited:
+            self._count("rejected")
+            raise
+
+    async def _call(self, tokens: int, fn: Callable[[], Awaitable[T]]) -> T:
+        await self.acquire(tokens)
+        attempt = 0
+        while True:
+            self._count("calls")
+            try:
+                return await fn()
+            except Exception as e:
+                if self._give_up(attempt, e):
+                    if isinstance(e, openai.RateLimitError):
+                        raise self._upstream_limited(e) from e
+                    raise
+                await asyncio.sleep(self._backoff(attempt, e))
+                attempt += 1
+                # Un reintento también consume cuota del proveedor
+                await self.bucket.acquire(tokens, block=True)
+
+    def call_sync(self, tokens: int, fn: Callable[[], T]) -> T:
+        self.bucket.acquire_sync(tokens)
+        attempt = 0
+        while True:
+            self._count("calls")
+            try:
+                return fn()
+            except Exception as e:
+                if self._give_up(attempt, e):
+                    raise
+                time.sleep(self._backoff(attempt, e))
+                attempt += 1
+                self.bucket.acquire_sync(tokens)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counts, "in_flight_keys": len(self.flights), **self.bucket.stats()}
+
+def _messages_key(kind: str, messages: List[BaseMessage], extra: Dict[str, Any]) -> str:
+    h = hashlib.sha256(kind.encode())
+    for m in messages:
+        h.update(f"\x1e{m.type}\x1f{m.content}".encode())
+    h.update(json.dumps(extra, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+def _usage_tokens(result: ChatResult) -> int:
+    usage = getattr(result.generations[0].message, "usage_metadata", None) if result.generations else None
+    return usage["total_tokens"] if usage else 0
+
+class GatewayChatModel(BaseChatModel):
+    """Chat model that sends every call of `inner` through a `Gateway`.
+
+    Identical prompts in flight are coalesced (non-streaming calls only);
+    streams are budgeted and retried only until their first chunk.
+    """
+
+    inner: BaseChatModel
+    gateway: Any
+    expected_completion_tokens: int = 300
+
+    @property
+    def _llm_type(self) -> str:
+        return f"gateway-{self.inner._llm_type}"
+
+    def _estimate(self, messages: List[BaseMessage]) -> int:
+        return sum(count_tokens(str(m.content)) for m in messages) + self.expected_completion_tokens
+
+    def _settle(self, estimated: int, result: ChatResult) -> ChatResult:
+        actual = _usage_tokens(result)
+        if actual:
+            self.gateway.bucket.settle(estimated, actual)
+        return result
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        tokens = self._estimate(messages)
+        return self._settle(tokens, self.gateway.call_sync(
+            tokens, lambda: self.inner._generate(messages, stop=stop, **kwargs)))
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        tokens = self._estimate(messages)
+
+        async def upstream() -> ChatResult:
+            return self._settle(tokens, await self.inner._agenerate(messages, stop=stop, **kwargs))
+        return await self.gateway.call(_messages_key("chat", messages, {"stop": stop, **kwargs}), tokens, upstream)
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        self.gateway.bucket.acquire_sync(self._estimate(messages))
+        self.gateway._count("calls")
+        yield from self.inner._stream(messages, stop=stop, **kwargs)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        gateway: Gateway = self.gateway
+        tokens = self._estimate(messages)
+        await gateway.acquire(tokens)
+        attempt = 0
+        while True:
+            gateway._count("calls")
+            started = False
+            try:
+                async for chunk in self.inner._astream(messages, stop=stop, **kwargs):
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                # Con tokens ya enviados al cliente no se puede reintentar
+                if started or gateway._give_up(attempt, e):
+                    if isinstance(e, openai.RateLimitError) and not started:
+                        raise gateway._upstream_limited(e) from e
+                    raise
+                await asyncio.sleep(gateway._backoff(attempt, e))
+                attempt += 1
+                # Un reintento también consume cuota del proveedor
+                await gateway.bucket.acquire(tokens, block=True)
+
+class GatewayEmbeddings(Embeddings):
+    """Embeddings of `underlying` through a `Gateway` (identical in-flight requests coalesced)."""
+
+    def __init__(self, underlying: Embeddings, gateway: Gateway):
+        self.underlying = underlying
+        self.gateway = gateway
+
+    @staticmethod
+    def _tokens(texts: List[str]) -> int:
+        return sum(count_tokens(t) for t in texts)
+
+    @staticmethod
+    def _key(kind: str, texts: List[str]) -> str:
+        h = hashlib.sha256(kind.encode())
+        for t in texts:
+            h.update(b"\x1e" + t.encode())
+        return h.hexdigest()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.gateway.call_sync(self._tokens(texts), lambda: self.underlying.embed_documents(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.gateway.call_sync(self._tokens([text]), lambda: self.underlying.embed_query(text))
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.gateway.call(self._key("docs", texts), self._tokens(texts),
+                                       lambda: self.underlying.aembed_documents(texts))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.gateway.call(self._key("query", [text]), self._tokens([text]),
+                                       lambda: self.underlying.aembed_query(text))
+
+def llm_gateway() -> Gateway:
+    return Gateway("llm", settings.LLM_RPM, settings.LLM_TPM, settings.GATEWAY_MAX_QUEUE, settings.GATEWAY_MAX_WAIT,
+                   settings.GATEWAY_MAX_RETRIES, settings.GATEWAY_RETRY_BASE, settings.GATEWAY_RETRY_MAX)
+
+def embedding_gateway() -> Gateway:
+    return Gateway("embeddings", settings.EMBEDDING_RPM, settings.EMBEDDING_TPM, settings.GATEWAY_MAX_QUEUE,
+                   settings.GATEWAY_MAX_WAIT, settings.GATEWAY_MAX_RETRIES, settings.GATEWAY_RETRY_BASE,
+                   settings.GATEWAY_RETRY_MAX)
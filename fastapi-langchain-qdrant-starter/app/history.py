@@ -1,24 +1,215 @@
-from typing import Dict
-import os
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Sequence, Tuple
+import redis
+import redis.asyncio as aioredis
 from langchain_core.chat_history import BaseChatMessageHistory
-from langchain_community.chat_message_histories import ChatMessageHistory, RedisChatMessageHistory
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+from langchain_community.chat_message_histories import ChatMessageHistory
+from .deps import existing_client, get_async_redis_pool, get_redis_pool
+from . import settings
 
-_in_memory_store: Dict[str, ChatMessageHistory] = {}
+class CappedChatMessageHistory(ChatMessageHistory):
+    """In-memory history that keeps only the last `max_messages` messages (0 = no cap)."""
+
+    max_messages: int = 0
+    # Resumen acumulado de los turnos que ya salieron de la ventana (ver compaction.py)
+    summary: str = ""
+    summary_marker: str = ""
+
+    def add_message(self, message: BaseMessage) -> None:
+        self.add_messages([message])
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self.messages.extend(messages)
+        if self.max_messages and len(self.messages) > self.max_messages:
+            del self.messages[:-self.max_messages]
+
+class BoundedHistoryStore:
+    """Session histories with LRU eviction past `max_sessions` and idle-TTL expiry."""
+
+    def __init__(self, max_sessions: int, idle_ttl: float, max_messages: int):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_messages = max_messages
+        self.evicted_lru = 0
+        self.evicted_idle = 0
+        self._data: "OrderedDict[str, Tuple[float, CappedChatMessageHistory]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float) -> None:
+        # El orden LRU coincide con el de último acceso: basta mirar el principio
+        while self._data and self.idle_ttl:
+            sid, (last, _) = next(iter(self._data.items()))
+            if now - last < self.idle_ttl:
+                break
+            del self._data[sid]
+            self.evicted_idle += 1
+
+    def get(self, session_id: str) -> CappedChatMessageHistory:
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            item = self._data.pop(session_id, None)
+            history = item[1] if item else CappedChatMessageHistory(max_messages=self.max_messages)
+            self._data[session_id] = (now, history)
+            while len(self._data) > self.max_sessions:
+                self._data.popitem(last=False)
+                self.evicted_lru += 1
+            return history
+
+    def pop(self, session_id: str) -> None:
+        with self._lock:
+            self._data.pop(session_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._expire(time.monotonic())
+            histories = [h for _, h in self._data.values()]
+        messages = sum(len(h.messages) for h in histories)
+        approx_bytes = sum(sys.getsizeof(m.content) for h in histories for m in h.messages)
+        return {
+            "backend": "memory",
+            "sessions": len(histories),
+            "max_sessions": self.max_sessions,
+            "messages": messages,
+            "approx_content_bytes": approx_bytes,
+            "evicted_lru": self.evicted_lru,
+            "evicted_idle": self.evicted_idle,
+        }
+
+class PooledRedisChatMessageHistory(BaseChatMessageHistory):
+    """Redis history on the process-wide connection pools.
+
+    Same key layout as RedisChatMessageHistory (LPUSH onto
+    `message_store:<session_id>`), so existing sessions keep working. Appends
+    go in one pipelined round trip: LPUSH of every message, optional LTRIM to
+    `max_messages` and optional EXPIRE.
+    """
+
+    key_prefix = "message_store:"
+    summary_prefix = "summary_store:"
+
+    def __init__(self, session_id: str, max_messages: int = 0, ttl: int = 0):
+        self.session_id = session_id
+        self.max_messages = max_messages
+        self.ttl = ttl
+
+    @property
+    def key(self) -> str:
+        return self.key_prefix + self.session_id
+
+    @property
+    def summary_key(self) -> str:
+        return self.summary_prefix + self.session_id
+
+    @staticmethod
+    def _client() -> redis.Redis:
+        return redis.Redis(connection_pool=get_redis_pool())
+
+    @staticmethod
+    def _aclient() -> aioredis.Redis:
+        return aioredis.Redis(connection_pool=get_async_redis_pool())
+
+    @staticmethod
+    def _decode(items: List[bytes]) -> List[BaseMessage]:
+        # LPUSH deja el mensaje más nuevo al principio
+        return messages_from_dict([json.loads(m) for m in reversed(items)])
+
+    def _queue_append(self, pipe, messages: Sequence[BaseMessage]) -> None:
+        pipe.lpush(self.key, *[json.dumps(message_to_dict(m)) for m in messages])
+        if self.max_messages:
+            pipe.ltrim(self.key, 0, self.max_messages - 1)
+        if self.ttl:
+            pipe.expire(self.key, self.ttl)
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        return self._decode(self._client().lrange(self.key, 0, -1))
+
+    async def aget_messages(self) -> List[BaseMessage]:
+        return self._decode(await self._aclient().lrange(self.key, 0, -1))
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        if not messages:
+            return
+        pipe = self._client().pipeline(transaction=False)
+        self._queue_append(pipe, messages)
+        pipe.execute()
+
+    async def aadd_messages(self, messages: Sequence[BaseMessage]) -> None:
+        if not messages:
+            return
+        pipe = self._aclient().pipeline(transaction=False)
+        self._queue_append(pipe, messages)
+        await pipe.execute()
+
+    def clear(self) -> None:
+        self._client().delete(self.key, self.summary_key)
+
+    async def aclear(self) -> None:
+        await self._aclient().delete(self.key, self.summary_key)
+
+    async def aget_summary(self) -> Tuple[str, str]:
+        summary, marker = await self._aclient().hmget(self.summary_key, "summary", "marker")
+        return (summary or b"").decode(), (marker or b"").decode()
+
+    async def aset_summary(self, summary: str, marker: str) -> None:
+        pipe = self._aclient().pipeline(transaction=False)
+        pipe.hset(self.summary_key, mapping={"summary": summary, "marker": marker})
+        if self.ttl:
+            pipe.expire(self.summary_key, self.ttl)
+        await pipe.execute()
+
+_in_memory_store = BoundedHistoryStore(
+    max_sessions=settings.HISTORY_MAX_SESSIONS,
+    idle_ttl=settings.HISTORY_IDLE_TTL,
+    max_messages=settings.HISTORY_MAX_MESSAGES,
+)
 
 def get_session_history(session_id: str) -> BaseChatMessageHistory:
     """Return a chat history bound to `session_id`.
-    Uses Redis if REDIS_URL is set, otherwise in-memory store.
+    Uses Redis if REDIS_URL is set, otherwise the bounded in-memory store.
     """
-    url = os.getenv("REDIS_URL", "").strip()
-    if url:
-        return RedisChatMessageHistory(session_id=session_id, url=url)
-    if session_id not in _in_memory_store:
-        _in_memory_store[session_id] = ChatMessageHistory()
-    return _in_memory_store[session_id]
+    if settings.REDIS_URL:
+        return PooledRedisChatMessageHistory(
+            session_id, max_messages=settings.HISTORY_MAX_MESSAGES, ttl=settings.HISTORY_REDIS_TTL)
+    return _in_memory_store.get(session_id)
 
 def clear_session(session_id: str) -> None:
-    url = os.getenv("REDIS_URL", "").strip()
-    if url:
-        RedisChatMessageHistory(session_id=session_id, url=url).clear()
+    if settings.REDIS_URL:
+        PooledRedisChatMessageHistory(session_id).clear()
     else:
-        _in_memory_store.pop(session_id, None)
+        _in_memory_store.pop(session_id)
+
+async def aget_summary(session_id: str) -> Tuple[str, str]:
+    """Return (summary, marker) stored next to the session history."""
+    history = get_session_history(session_id)
+    if isinstance(history, PooledRedisChatMessageHistory):
+        return await history.aget_summary()
+    return history.summary, history.summary_marker
+
+async def aset_summary(session_id: str, summary: str, marker: str) -> None:
+    history = get_session_history(session_id)
+    if isinstance(history, PooledRedisChatMessageHistory):
+        await history.aset_summary(summary, marker)
+    else:
+        history.summary, history.summary_marker = summary, marker
+
+def history_stats() -> Dict[str, Any]:
+    if settings.REDIS_URL:
+        # Solo los pools ya creados (el de /chat es el async); consultar no debe crear ninguno
+        pools = {}
+        for name, key in (("async", "redis_async"), ("sync", "redis")):
+            pool = existing_client(key)
+            if pool is not None:
+                pools[name] = {
+                    "max_connections": pool.max_connections,
+                    "in_use": len(pool._in_use_connections),
+                    "idle": len(pool._available_connections),
+                }
+        return {"backend": "redis", "pools": pools}
+    return _in_memory_store.stats()
@@ -1,32 +1,127 @@
-from typing import Iterable, List
+import hashlib
+import json
+import logging
+import multiprocessing
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, asdict, field
+from datetime import datetime
+from typing import Callable, Deque, Dict, Iterator, List, NamedTuple, Optional, Tuple
 from pathlib import Path
-from langchain_community.document_loaders import DirectoryLoader, TextLoader
+from langchain_community.document_loaders import TextLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
 from qdrant_client.http import models as rest
-from .deps import get_vector_store, get_qdrant_client, get_embeddings
+from sqlmodel import select
+from .db import get_session
+from .deps import get_qdrant_client, get_embeddings
+from .models import IngestManifest
+from .retrieval import CONTENT_KEY, METADATA_KEY
+from .sparse import SPARSE_VECTOR_NAME, encode_document
+from .tokens import count_tokens
 from . import settings
 
-def load_documents(path: str) -> List[Document]:
+logger = logging.getLogger(__name__)
+
+# Load .txt and .md files; you can extend with PDF, etc.
+PATTERNS = ("**/*.txt", "**/*.md")
+
+# Namespace fijo: el mismo (source, chunk, hash) produce siempre el mismo id de punto
+POINT_ID_NAMESPACE = uuid.UUID("6f1c1d2e-8a8f-4d8e-9c36-2f0d6b7a1e55")
+
+class IngestCancelled(Exception):
+    """Raised inside ingest_path when its cancel event is set."""
+
+@dataclass
+class IngestReport:
+    files_seen: int = 0
+    files_changed: int = 0
+    files_unchanged: int = 0
+    files_removed: int = 0
+    chunks_upserted: int = 0
+    points_deleted: int = 0
+    tokens_embedded: int = 0
+    started_at: float = field(default_factory=time.monotonic, repr=False)
+    elapsed_s: float = 0.0
+
+    def tick(self) -> None:
+        self.elapsed_s = time.monotonic() - self.started_at
+
+    def as_dict(self) -> dict:
+        out = asdict(self)
+        out.pop("started_at")
+        elapsed = self.elapsed_s or 1e-9
+        out.update(
+            docs_per_s=round(self.files_changed / elapsed, 2),
+            chunks_per_s=round(self.chunks_upserted / elapsed, 2),
+            tokens_per_s=round(self.tokens_embedded / elapsed, 2),
+        )
+        return out
+
+def iter_files(path: str) -> Iterator[Path]:
     base_path = Path(path)
     if not base_path.exists():
         raise FileNotFoundError(f"Data path not found: {path}")
+    for pattern in PATTERNS:
+        yield from sorted(p for p in base_path.glob(pattern) if p.is_file())
 
-    # Load .txt and .md files; you can extend with PDF, etc.
-    loaders = [
-        DirectoryLoader(path, glob="**/*.txt", loader_cls=TextLoader, show_progress=True),
-        DirectoryLoader(path, glob="**/*.md", loader_cls=TextLoader, show_progress=True),
-    ]
-    docs: List[Document] = []
-    for loader in loaders:
-        docs.extend(loader.load())
-    return docs
+def file_hash(file: Path) -> str:
+    return hashlib.sha256(file.read_bytes()).hexdigest()
 
 def split_documents(docs: List[Document]) -> List[Document]:
     splitter = RecursiveCharacterTextSplitter(chunk_size=800, chunk_overlap=120)
     return splitter.split_documents(docs)
 
-def recreate_collection_if_needed(dimension: int, force: bool = False):
+def point_ids(source: str, content_hash: str, n_chunks: int) -> List[str]:
+    return [str(uuid.uuid5(POINT_ID_NAMESPACE, f"{source}:{i}:{content_hash}")) for i in range(n_chunks)]
+
+QUANTIZATION_MODES = ("", "scalar", "binary")
+
+def quantization_config(mode: str) -> Optional[rest.QuantizationConfig]:
+    # Los vectores cuantizados quedan en RAM; los originales pueden ir a disco y solo se leen al re-puntuar
+    if mode == "scalar":
+        return rest.ScalarQuantization(scalar=rest.ScalarQuantizationConfig(
+            type=rest.ScalarType.INT8, quantile=0.99, always_ram=True))
+    if mode == "binary":
+        return rest.BinaryQuantization(binary=rest.BinaryQuantizationConfig(always_ram=True))
+    if mode:
+        raise ValueError(f"Unknown quantization: {mode!r} (expected one of {QUANTIZATION_MODES})")
+    return None
+
+@dataclass
+class IndexConfig:
+    """Collection/index options; None falls back to the QDRANT_* settings."""
+    hnsw_m: Optional[int] = None
+    hnsw_ef_construct: Optional[int] = None
+    quantization: Optional[str] = None  # "", "scalar" o "binary"
+    on_disk: Optional[bool] = None
+    on_disk_payload: Optional[bool] = None
+
+    def resolved_quantization(self) -> str:
+        return self.quantization if self.quantization is not None else settings.QDRANT_QUANTIZATION
+
+    def resolved_on_disk(self) -> bool:
+        return self.on_disk if self.on_disk is not None else settings.QDRANT_ON_DISK
+
+    def resolved_on_disk_payload(self) -> bool:
+        return self.on_disk_payload if self.on_disk_payload is not None else settings.QDRANT_ON_DISK_PAYLOAD
+
+    def hnsw(self) -> rest.HnswConfigDiff:
+        return rest.HnswConfigDiff(
+            m=self.hnsw_m if self.hnsw_m is not None else settings.QDRANT_HNSW_M,
+            ef_construct=self.hnsw_ef_construct if self.hnsw_ef_construct is not None else settings.QDRANT_HNSW_EF_CONSTRUCT,
+        )
+
+def has_sparse_vectors(client, name: str) -> bool:
+    sparse = client.get_collection(name).config.params.sparse_vectors or {}
+    return SPARSE_VECTOR_NAME in sparse
+
+def recreate_collection_if_needed(dimension: int, force: bool = False, index: Optional[IndexConfig] = None) -> bool:
+    """Create (or update) the collection; returns whether it stores BM25 sparse vectors."""
+    index = index or IndexConfig()
     client = get_qdrant_client()
     name = settings.QDRANT_COLLECTION
     exists = name in [c.name for c in client.get_collections().collections]
@@ -36,17 +131,212 @@ def recreate_collection_if_needed(dimension: int, force: bool = False):
     if not exists:
         client.create_collection(
             collection_name=name,
-            vectors_config=rest.VectorParams(size=dimension, distance=rest.Distance.COSINE),
+            vectors_config=rest.VectorParams(
+                size=dimension, distance=rest.Distance.COSINE, on_disk=index.resolved_on_disk()),
+            hnsw_config=index.hnsw(),
+            optimizers_config=rest.OptimizersConfigDiff(indexing_threshold=settings.QDRANT_INDEXING_THRESHOLD),
+            quantization_config=quantization_config(index.resolved_quantization()),
+            on_disk_payload=index.resolved_on_disk_payload(),
+            # El IDF de BM25 lo calcula Qdrant sobre la colección; nosotros solo enviamos el TF normalizado
+            sparse_vectors_config={SPARSE_VECTOR_NAME: rest.SparseVectorParams(modifier=rest.Modifier.IDF)}
+            if settings.SPARSE_VECTORS else None,
         )
+    else:
+        # Solo se tocan las opciones pedidas explícitamente; Qdrant reindexa/recuantiza en segundo plano
+        update = {}
+        if index.hnsw_m is not None or index.hnsw_ef_construct is not None:
+            update["hnsw_config"] = index.hnsw()
+        if index.quantization is not None:
+            update["quantization_config"] = quantization_config(index.quantization) or rest.Disabled.DISABLED
+        if index.on_disk is not None:
+            update["vectors_config"] = {"": rest.VectorParamsDiff(on_disk=index.on_disk)}
+        if index.on_disk_payload is not None:
+            update["collection_params"] = rest.CollectionParamsDiff(on_disk_payload=index.on_disk_payload)
+        if update:
+            client.update_collection(collection_name=name, **update)
+    # Índice de payload para filtrar por fuente sin recorrer todos los puntos (idempotente)
+    client.create_payload_index(name, f"{METADATA_KEY}.source", rest.PayloadSchemaType.KEYWORD)
+    return has_sparse_vectors(client, name)
+
+@dataclass
+class _FileState:
+    source: str
+    digest: str
+    ids: List[str]
+    previous: Optional[IngestManifest]
+    remaining: int  # chunks aún no subidos a Qdrant
 
-def ingest_path(path: str, reset: bool = False) -> int:
-    docs = load_documents(path)
-    chunks = split_documents(docs)
+class _Chunk(NamedTuple):
+    source: str
+    point_id: str
+    text: str
+    metadata: dict
+    sparse: Tuple[List[int], List[float]]
+
+def _split_file(source: str) -> List[Tuple[str, dict, int, Tuple[List[int], List[float]]]]:
+    # Corre en un proceso del pool: devuelve datos simples (picklables)
+    return [(d.page_content, d.metadata, count_tokens(d.page_content), encode_document(d.page_content))
+            for d in split_documents(TextLoader(source).load())]
+
+def _iter_split(sources: Iterator[str], workers: int) -> Iterator[Tuple[str, list]]:
+    """Split files in a process pool, keeping at most 2*workers files in flight."""
+    if workers <= 1:
+        for source in sources:
+            yield source, _split_file(source)
+        return
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        window: Deque[Tuple[str, Future]] = deque()
+        for source in sources:
+            window.append((source, pool.submit(_split_file, source)))
+            if len(window) >= 2 * workers:
+                src, fut = window.popleft()
+                yield src, fut.result()
+        while window:
+            src, fut = window.popleft()
+            yield src, fut.result()
+
+def _embed_and_upsert(batch: List[_Chunk], sparse: bool) -> List[_Chunk]:
+    embeddings = get_embeddings()
+    vectors = embeddings.embed_documents([c.text for c in batch])
+    points = []
+    for chunk, vector in zip(batch, vectors):
+        if sparse:
+            indices, values = chunk.sparse
+            vector = {"": vector, SPARSE_VECTOR_NAME: rest.SparseVector(indices=indices, values=values)}
+        points.append(rest.PointStruct(
+            id=chunk.point_id, vector=vector, payload={CONTENT_KEY: chunk.text, METADATA_KEY: chunk.metadata}))
+    get_qdrant_client().upsert(collection_name=settings.QDRANT_COLLECTION, points=points, wait=False)
+    return batch
+
+def _load_manifest(base_path: Path) -> Dict[str, IngestManifest]:
+    with get_session() as s:
+        rows = s.exec(select(IngestManifest).where(IngestManifest.collection == settings.QDRANT_COLLECTION)).all()
+    # Solo los archivos bajo `base_path`: otra ruta ingerida en la misma colección no se toca
+    return {r.source: r for r in rows if Path(r.source).is_relative_to(base_path)}
+
+def _delete_points(ids: List[str]) -> int:
+    if ids:
+        get_qdrant_client().delete(settings.QDRANT_COLLECTION, points_selector=rest.PointIdsList(points=ids))
+    return len(ids)
+
+def _save_manifest(state: _FileState) -> None:
+    with get_session() as s:
+        row = s.get(IngestManifest, (settings.QDRANT_COLLECTION, state.source)) or IngestManifest(
+            collection=settings.QDRANT_COLLECTION, source=state.source, content_hash=state.digest, point_ids_json="[]")
+        row.content_hash = state.digest
+        row.point_ids_json = json.dumps(state.ids)
+        row.updated_at = datetime.utcnow()
+        s.add(row)
+        s.commit()
+
+def ingest_path(
+    path: str,
+    reset: bool = False,
+    incremental: bool = True,
+    on_progress: Optional[Callable[[IngestReport], None]] = None,
+    cancel_event: Optional[threading.Event] = None,
+    index: Optional[IndexConfig] = None,
+) -> IngestReport:
+    """Index the .txt/.md files under `path` into the collection.
+
+    Points get deterministic ids derived from (source, chunk index, content
+    hash), so re-running is idempotent. With `incremental`, files whose hash
+    matches the manifest are skipped. Files that disappeared from `path` have
+    their points deleted. `reset` drops the collection and the manifest first.
+
+    Files are streamed: split in a process pool, embedded in batches of
+    INGEST_BATCH_SIZE chunks with INGEST_EMBED_CONCURRENCY batches in flight,
+    and upserted without waiting for indexing. Memory stays bounded by the
+    batch size, not the corpus size. `on_progress` is called after each batch.
+
+    Setting `cancel_event` stops the run with IngestCancelled. Files already
+    upserted keep their manifest rows, so the next run picks up from there.
+    """
+    base_path = Path(path)
     embeddings = get_embeddings()
 
     # Ensure collection exists (or recreate with correct dimension)
-    recreate_collection_if_needed(dimension=embeddings.embed_query("dim-probe").__len__(), force=reset)
+    sparse = recreate_collection_if_needed(dimension=embeddings.dimension(), force=reset, index=index)
+    if reset:
+        with get_session() as s:
+            for row in s.exec(select(IngestManifest).where(IngestManifest.collection == settings.QDRANT_COLLECTION)):
+                s.delete(row)
+            s.commit()
+
+    manifest = _load_manifest(base_path)
+    report = IngestReport()
+    states: Dict[str, _FileState] = {}
+
+    def check_cancelled() -> None:
+        if cancel_event is not None and cancel_event.is_set():
+            raise IngestCancelled(f"ingest of {path} cancelled")
+
+    def changed_sources() -> Iterator[str]:
+        for file in iter_files(path):
+            check_cancelled()
+            source = str(file)
+            digest = file_hash(file)
+            entry = manifest.pop(source, None)
+            report.files_seen += 1
+            if incremental and entry is not None and entry.content_hash == digest:
+                report.files_unchanged += 1
+                continue
+            states[source] = _FileState(source, digest, [], entry, 0)
+            yield source
+
+    def finish_file(state: _FileState) -> None:
+        # Chunks de la versión anterior del archivo que ya no existen
+        stale = sorted(set(json.loads(state.previous.point_ids_json)) - set(state.ids)) if state.previous else []
+        report.points_deleted += _delete_points(stale)
+        report.files_changed += 1
+        _save_manifest(state)
+        del states[state.source]
+
+    def batch_done(batch) -> None:
+        for chunk in batch:
+            states[chunk.source].remaining -= 1
+        report.chunks_upserted += len(batch)
+        for source in {chunk.source for chunk in batch}:
+            if states[source].remaining == 0:
+                finish_file(states[source])
+        report.tick()
+        logger.debug("ingest %s: %s", settings.QDRANT_COLLECTION, report.as_dict())
+        if on_progress:
+            on_progress(report)
+        check_cancelled()
+
+    batch: List[_Chunk] = []
+    in_flight: Deque[Future] = deque()
+    with ThreadPoolExecutor(max_workers=settings.INGEST_EMBED_CONCURRENCY) as embed_pool:
+        def submit(batch):
+            in_flight.append(embed_pool.submit(_embed_and_upsert, batch, sparse))
+            while len(in_flight) >= settings.INGEST_EMBED_CONCURRENCY:
+                batch_done(in_flight.popleft().result())
+
+        for source, chunks in _iter_split(changed_sources(), settings.INGEST_SPLIT_WORKERS):
+            state = states[source]
+            state.ids = point_ids(source, state.digest, len(chunks))
+            state.remaining = len(chunks)
+            if not chunks:
+                finish_file(state)
+                continue
+            for pid, (text, metadata, n_tokens, sparse_vector) in zip(state.ids, chunks):
+                batch.append(_Chunk(source, pid, text, metadata, sparse_vector))
+                report.tokens_embedded += n_tokens
+                if len(batch) >= settings.INGEST_BATCH_SIZE:
+                    submit(batch)
+                    batch = []
+        if batch:
+            submit(batch)
+        while in_flight:
+            batch_done(in_flight.popleft().result())
 
-    vs = get_vector_store()
-    vs.add_documents(chunks)
-    return len(chunks)
+    # Lo que queda en el manifest ya no está en disco: borramos sus puntos
+    for entry in manifest.values():
+        report.points_deleted += _delete_points(json.loads(entry.point_ids_json))
+        report.files_removed += 1
+        with get_session() as s:
+            s.delete(s.get(IngestManifest, (entry.collection, entry.source)))
+            s.commit()
+    report.tick()
+    return report
@@ -0,0 +1,133 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from .ingest import IndexConfig, IngestCancelled, IngestReport, ingest_path
+from . import settings
+
+logger = logging.getLogger(__name__)
+
+class JobConflict(Exception):
+    """Another ingestion job is already running for the collection."""
+
+@dataclass
+class IngestJob:
+    job_id: str
+    collection: str
+    path: str
+    reset: bool
+    incremental: bool
+    index: IndexConfig = field(default_factory=IndexConfig)
+    status: str = "queued"  # queued | running | succeeded | failed | cancelled
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    report: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    cancel_event: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("succeeded", "failed", "cancelled")
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "collection": self.collection,
+            "path": self.path,
+            "reset": self.reset,
+            "incremental": self.incremental,
+            "index": asdict(self.index),
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "report": self.report,
+            "error": self.error,
+        }
+
+class IngestJobManager:
+    """Runs ingest_path in background threads, one job at a time per collection.
+
+    Finished jobs are kept (up to `history`) so their status can be polled.
+    `on_success` runs in the worker thread after a job that changed something.
+    """
+
+    def __init__(self, max_workers: int = 1, history: int = 100,
+                 on_success: Optional[Callable[[IngestReport], None]] = None):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+        self._active: Dict[str, str] = {}  # colección -> job_id
+        self._lock = threading.Lock()
+        self._history = history
+        self._on_success = on_success
+
+    def submit(self, path: str, reset: bool = False, incremental: bool = True,
+               index: Optional[IndexConfig] = None) -> IngestJob:
+        if not Path(path).exists():
+            raise FileNotFoundError(f"Data path not found: {path}")
+        collection = settings.QDRANT_COLLECTION
+        with self._lock:
+            if collection in self._active:
+                raise JobConflict(f"job {self._active[collection]} is already ingesting into {collection}")
+            job = IngestJob(uuid.uuid4().hex, collection, path, reset, incremental, index or IndexConfig())
+            self._jobs[job.job_id] = job
+            self._active[collection] = job.job_id
+            self._trim()
+        self._executor.submit(self._run, job)
+        return job
+
+    def _trim(self) -> None:
+        finished = [jid for jid, j in self._jobs.items() if j.done]
+        for jid in finished[:max(0, len(self._jobs) - self._history)]:
+            del self._jobs[jid]
+
+    def _run(self, job: IngestJob) -> None:
+        job.status = "running"
+        job.started_at = time.time()
+
+        def progress(report: IngestReport) -> None:
+            job.report = report.as_dict()
+
+        try:
+            if job.cancel_event.is_set():
+                raise IngestCancelled("cancelled before start")
+            report = ingest_path(job.path, reset=job.reset, incremental=job.incremental,
+                                 on_progress=progress, cancel_event=job.cancel_event, index=job.index)
+            job.report = report.as_dict()
+            job.status = "succeeded"
+            logger.info("ingest job %s succeeded: %s", job.job_id, job.report)
+            if self._on_success and (report.files_changed or report.files_removed or job.reset):
+                self._on_success(report)
+        except IngestCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            logger.exception("ingest job %s failed", job.job_id)
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._active.pop(job.collection, None)
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        return self._jobs.get(job_id)
+
+    def list(self) -> List[IngestJob]:
+        return list(reversed(self._jobs.values()))
+
+    def cancel(self, job_id: str) -> Optional[IngestJob]:
+        job = self._jobs.get(job_id)
+        if job is not None and not job.done:
+            job.cancel_event.set()
+        return job
+
+    def shutdown(self) -> None:
+        for job in list(self._jobs.values()):
+            job.cancel_event.set()
+        self._executor.shutdown(wait=True, cancel_futures=True)
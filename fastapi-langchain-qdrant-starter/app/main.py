@@ -1,25 +1,82 @@
-from fastapi import FastAPI, Body, HTTPException
-from pydantic import BaseModel
-from typing import List, Dict, Any
+from fastapi import FastAPI, Body, HTTPException, Depends, Query, Request, Response
+from pydantic import BaseModel, Field
+from typing import List, Dict, Any, Literal, Optional
+from dataclasses import dataclass, field
+from datetime import datetime
 from fastapi.middleware.cors import CORSMiddleware
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough, RunnableWithMessageHistory
-from operator import itemgetter
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.language_models import BaseChatModel
+from sqlalchemy import and_, or_
+from sqlmodel import select
 from uuid import uuid4
+import asyncio
+import json
+import logging
+import math
+import time
 
-from .deps import get_vector_store, get_llm
-from .ingest import ingest_path
-from .db import init_db, get_session
+from .deps import get_embedding_gateway, get_embeddings, get_llm, get_llm_gateway, init_clients, close_clients
+from .gateway import RateLimited
+from .ingest import IndexConfig
+from .jobs import IngestJobManager, JobConflict
+from .db import init_db, get_session, engine
 from .models import ChatSession, ChatMessage, ChatMessageRead
-from .history import get_session_history, clear_session
+from .metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE, HTTP_SECONDS, configure_logging, observe_turn,
+    record_llm_usage, register_cache, render as metrics_render, start_trace,
+)
+from .persistence import TurnRecord, write_behind
+from .history import get_session_history, clear_session, history_stats
+from .compaction import CompactedHistory, acompact, schedule_summary_update
+from .rag import acondense_question, answer_messages, doc_sources, condense_cache
+from .rerank import arerank, resolve_mode, score_cache
+from .retrieval import aembed_query, asearch
+from .semantic_cache import semantic_cache
+from .timing import StageTimer
 from . import settings
 
+logger = logging.getLogger(__name__)
+
 app = FastAPI(title="FastAPI + LangChain + Qdrant (RAG) with Sessions + History")
 
 @app.on_event("startup")
 def _startup():
+    configure_logging()
     init_db()
+    init_clients()
+    write_behind.start()
+    register_cache("condense", condense_cache.stats)
+    register_cache("query_embedding", lambda: get_embeddings().query_cache.stats())
+    register_cache("rerank", score_cache.stats)
+    if semantic_cache is not None:
+        register_cache("semantic", semantic_cache.stats)
+
+@app.on_event("shutdown")
+async def _shutdown():
+    await run_in_threadpool(ingest_jobs.shutdown)
+    await run_in_threadpool(write_behind.stop)
+    await close_clients()
+
+@app.middleware("http")
+async def _trace_requests(request: Request, call_next):
+    # Trace id por request (logs + cabecera) y latencia HTTP por ruta
+    trace = start_trace(request.headers.get("x-request-id"))
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    HTTP_SECONDS.labels(request.method, route, response.status_code).observe(time.perf_counter() - start)
+    response.headers["X-Request-ID"] = trace.trace_id
+    return response
+
+@app.exception_handler(RateLimited)
+async def _rate_limited(request: Request, exc: RateLimited):
+    # Backpressure: el cliente reintenta más tarde en vez de encolarse sin límite
+    return JSONResponse(status_code=429, content={"detail": str(exc)},
+                        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))})
 
 app.add_middleware(
     CORSMiddleware,
@@ -31,16 +88,41 @@ app.add_middleware(
 class ChatRequest(BaseModel):
     session_id: str
     message: str
-    k: int = 4
+    k: int = Field(4, ge=1, le=50)
+    # Ajustes de recuperación (recall vs. latencia)
+    hybrid: Optional[bool] = Field(None, description="dense + BM25 with RRF fusion (default HYBRID_SEARCH)")
+    ef: Optional[int] = Field(None, ge=1, description="HNSW ef at search time")
+    score_threshold: Optional[float] = Field(None, description="minimum dense (cosine) score; disables hybrid search")
+    filter: Optional[Dict[str, Any]] = Field(None, description="metadata key -> value (or list of values)")
+    mmr: bool = False
+    fetch_k: int = Field(20, ge=1, le=200)
+    mmr_lambda: float = Field(0.5, ge=0, le=1)
+    # Solo en colecciones cuantizadas
+    rescore: Optional[bool] = None
+    oversampling: Optional[float] = Field(None, ge=1)
+    # Re-ranking de RERANK_CANDIDATES candidatos y presupuesto de tokens del contexto
+    rerank: Optional[bool] = Field(None, description="default: on when RERANK_MODE is set")
+    context_tokens: Optional[int] = Field(None, ge=1, description="default RERANK_CONTEXT_TOKENS")
 
 class IngestRequest(BaseModel):
     path: str = "data/docs"
     reset: bool = False
+    incremental: bool = True
+    hnsw_m: Optional[int] = Field(None, ge=0)
+    hnsw_ef_construct: Optional[int] = Field(None, ge=4)
+    quantization: Optional[Literal["", "scalar", "binary"]] = None
+    on_disk: Optional[bool] = None
+    on_disk_payload: Optional[bool] = None
 
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
+@app.get("/metrics")
+def metrics():
+    """Prometheus exposition: stage/HTTP latency histograms, LLM tokens, cache and persistence counters."""
+    return Response(metrics_render(), media_type=METRICS_CONTENT_TYPE)
+
 # ---- Session helpers ----
 @app.post("/session")
 def create_session():
@@ -53,124 +135,333 @@ def delete_session(session_id: str):
     return {"deleted": session_id}
 
 # ---- Ingest ----
-@app.post("/ingest")
+def _after_ingest(report):
+    # Las respuestas cacheadas pueden citar documentos que ya cambiaron
+    if semantic_cache is not None:
+        semantic_cache.invalidate()
+
+ingest_jobs = IngestJobManager(on_success=_after_ingest)
+
+@app.post("/ingest", status_code=202)
 def ingest(req: IngestRequest):
+    """Queue an ingestion job; poll GET /ingest/{job_id} for progress."""
     try:
-        n = ingest_path(req.path, reset=req.reset)
-        return {"ingested_chunks": n, "collection": settings.QDRANT_COLLECTION}
+        job = ingest_jobs.submit(req.path, reset=req.reset, incremental=req.incremental, index=IndexConfig(
+            hnsw_m=req.hnsw_m, hnsw_ef_construct=req.hnsw_ef_construct, quantization=req.quantization,
+            on_disk=req.on_disk, on_disk_payload=req.on_disk_payload))
+    except JobConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    return job.as_dict()
+
+@app.get("/ingest")
+def list_ingest_jobs():
+    return [job.as_dict() for job in ingest_jobs.list()]
+
+@app.get("/ingest/{job_id}")
+def get_ingest_job(job_id: str):
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    return job.as_dict()
+
+@app.delete("/ingest/{job_id}")
+def cancel_ingest_job(job_id: str):
+    job = ingest_jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    return job.as_dict()
 
-def format_docs(docs):
-    return "\n\n".join([f"Fuente: {d.metadata.get('source', 'N/A')}\n{d.page_content}" for d in docs])
+@app.get("/history/stats")
+def get_history_stats():
+    return history_stats()
+
+@app.get("/persistence/stats")
+def get_persistence_stats():
+    return write_behind.stats()
+
+@app.get("/gateway/stats")
+def gateway_stats():
+    if not settings.LLM_GATEWAY:
+        return {"llm": None, "embeddings": None}
+    return {"llm": get_llm_gateway().stats(), "embeddings": get_embedding_gateway().stats()}
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {
+        "condense": condense_cache.stats(),
+        "semantic": semantic_cache.stats() if semantic_cache is not None else None,
+        "rerank": score_cache.stats(),
+    }
 
 # ---- Conversational RAG ----
-@app.post("/chat")
-def chat(req: ChatRequest):
-    if not req.message.strip():
-        raise HTTPException(status_code=400, detail="message is empty")
+@dataclass
+class _Turn:
+    history_obj: BaseChatMessageHistory
+    history: List[BaseMessage]
+    compacted: CompactedHistory  # ventanas por presupuesto de tokens para cada prompt
+    standalone: str
+    vector: List[float]
+    timer: StageTimer  # duración de cada etapa (cabecera Server-Timing)
+    docs: List[Document] = field(default_factory=list)
+    cached: Optional[Dict[str, Any]] = None  # acierto de la caché semántica
+    received_at: datetime = field(default_factory=datetime.utcnow)
 
-    vs = get_vector_store()
-    retriever = vs.as_retriever(search_kwargs={"k": req.k})
-    llm = get_llm()
-
-    # 1) Objetos de historial persistente/temporal
-    history_obj = get_session_history(req.session_id)  
-    # 2) Condensador de pregunta 
-    condense_prompt = ChatPromptTemplate.from_messages([
-        ("system",
-         "Reescribe la consulta del usuario como una pregunta independiente, breve y clara, "
-         "usando el historial si aporta contexto. Devuelve solo la pregunta reescrita."),
-        MessagesPlaceholder("history"),
-        ("human", "{question}")
-    ])
-    standalone = condense_prompt | llm
-    standalone = standalone.invoke({
-        "question": req.message,
-        "history": history_obj.messages,   # pasamos explícitamente la history al prompt
-    }).content.strip() or req.message
-
-    # 3) Recuperación con la pregunta condensada
-    docs = retriever.get_relevant_documents(standalone)
-    context_text = format_docs(docs)
-
-    # 4) Prompt final con contexto + historial (todavía NO actualizamos historial)
-    answer_prompt = ChatPromptTemplate.from_messages([
-        ("system",
-         "Eres un asistente experto. Responde en español con precisión y cita fuentes cuando existan. "
-         "Si no hay evidencia suficiente en el contexto, dilo explícitamente."
-         "Si la pregunta no está relacionada con el contexto responde: 'Mi objetivo es ayudarte con temas sobre los productos, nada más'"
-         "No asumas escenarios hipoteticos, no ayudes con preguntas generales."),
-        MessagesPlaceholder("history"),
-        ("human", "Pregunta: {question}\n\nContexto:\n{context}")
-    ])
-    messages = answer_prompt.format_messages(
-        history=history_obj.messages,   # historial actual
-        question=standalone,
-        context=context_text
-    )
-    reply_msg = llm.invoke(messages)
-    reply = reply_msg.content
+    @property
+    def sources(self) -> List[Dict[str, Any]]:
+        return self.cached["sources"] if self.cached else doc_sources(self.docs)
+
+def _use_semantic_cache(req: ChatRequest) -> bool:
+    # Con filtros de metadata (p. ej. por tenant) una respuesta cacheada podría venir de otros documentos
+    return semantic_cache is not None and not req.filter
 
-    # 5) Ahora SÍ: actualizamos historial de la sesión (original del usuario y respuesta)
-    history_obj.add_user_message(req.message)
-    history_obj.add_ai_message(reply)
+def _retrieval_key(req: ChatRequest) -> str:
+    # Solo se reutiliza una respuesta obtenida con la misma recuperación efectiva (defaults resueltos)
+    rerank_mode = resolve_mode(req.rerank)
+    return json.dumps({
+        "k": req.k,
+        "hybrid": (settings.HYBRID_SEARCH if req.hybrid is None else req.hybrid) and req.score_threshold is None,
+        "ef": req.ef,
+        "score_threshold": req.score_threshold,
+        "mmr": [req.fetch_k, req.mmr_lambda] if req.mmr else None,
+        "rescore": req.rescore,
+        "oversampling": req.oversampling,
+        "rerank": [rerank_mode, req.context_tokens or settings.RERANK_CONTEXT_TOKENS] if rerank_mode else None,
+    }, sort_keys=True, separators=(",", ":"))
+
+# La caché es una optimización: si su backend falla el turno sigue como un miss
+async def _cache_lookup(req: ChatRequest, vector: List[float]) -> Optional[Dict[str, Any]]:
+    try:
+        return await semantic_cache.alookup(vector, _retrieval_key(req))
+    except Exception:
+        semantic_cache.errors += 1
+        logger.warning("semantic cache lookup failed", exc_info=True)
+        return None
 
-    # 6) (Opcional) Persistir en DB si añadiste SQLModel (sesión, mensajes y fuentes)
+async def _cache_store(req: ChatRequest, turn: _Turn, reply: str) -> None:
     try:
-        from .db import get_session
-        from .models import ChatSession, ChatMessage
-        import json as _json
-        with get_session() as s:
-            if not s.get(ChatSession, req.session_id):
-                s.add(ChatSession(session_id=req.session_id))
-                s.commit()
-            s.add(ChatMessage(session_id=req.session_id, role="user", content=req.message))
-            s.add(ChatMessage(
-                session_id=req.session_id,
-                role="assistant",
-                content=reply,
-                standalone_question=standalone,
-                sources_json=_json.dumps([{"source": d.metadata.get("source", "N/A")} for d in docs])
-            ))
-            s.commit()
+        await semantic_cache.astore(turn.vector, _retrieval_key(req), turn.standalone, reply, turn.sources)
     except Exception:
-        # Si no tienes la parte de DB, ignoramos silenciosamente
-        pass
+        semantic_cache.errors += 1
+        logger.warning("semantic cache store failed", exc_info=True)
+
+async def _prepare_turn(req: ChatRequest, llm: BaseChatModel) -> _Turn:
+    """Steps shared by /chat and /chat/stream: history, condensed question and retrieval."""
+    if not req.message.strip():
+        raise HTTPException(status_code=400, detail="message is empty")
+    timer = StageTimer()
+
+    # 1) Historial y pre-embedding de la pregunta original en paralelo
+    history_obj = get_session_history(req.session_id)
+    raw_vector = asyncio.ensure_future(aembed_query(req.message))
+    try:
+        with timer.stage("history"):
+            # Copia: el backend en memoria devuelve su lista viva, que crece (y se recorta) al guardar el turno
+            history = list(await history_obj.aget_messages())
+            compacted = await acompact(req.session_id, history)
+        # 2) Condensador de pregunta
+        with timer.stage("condense"):
+            standalone = await acondense_question(llm, compacted.condense, req.message)
+        # 3) Embedding de la pregunta condensada (reutiliza el de la original si no cambió)
+        with timer.stage("embed"):
+            vector = await raw_vector if standalone == req.message else await aembed_query(standalone)
+    finally:
+        raw_vector.cancel()
+        # Si ya terminó con error y no se usó, se consume la excepción ("never retrieved")
+        raw_vector.add_done_callback(lambda t: t.cancelled() or t.exception())
+    turn = _Turn(history_obj, history, compacted, standalone, vector, timer)
+
+    # 4) Caché semántica: si ya respondimos algo casi idéntico no hace falta recuperar ni generar
+    if _use_semantic_cache(req):
+        with timer.stage("semantic_cache"):
+            turn.cached = await _cache_lookup(req, vector)
+    if turn.cached is None:
+        # Con re-ranking se recuperan más candidatos y solo los mejores llegan al prompt
+        rerank_mode = resolve_mode(req.rerank)
+        limit = max(req.k, settings.RERANK_CANDIDATES) if rerank_mode else req.k
+        with timer.stage("search"):
+            turn.docs = await asearch(
+                vector, limit, query_text=standalone, hybrid=req.hybrid, ef=req.ef, score_threshold=req.score_threshold, filters=req.filter,
+                mmr=req.mmr, fetch_k=req.fetch_k, mmr_lambda=req.mmr_lambda,
+                rescore=req.rescore, oversampling=req.oversampling,
+            )
+        if rerank_mode:
+            with timer.stage("rerank"):
+                turn.docs = await arerank(standalone, turn.docs, req.k, rerank_mode, req.context_tokens)
+    return turn
+
+async def _finish_turn(req: ChatRequest, llm: BaseChatModel, turn: _Turn, reply: str):
+    # Actualizamos historial de la sesión (original del usuario y respuesta) y persistimos en DB
+    new_messages = [HumanMessage(content=req.message), AIMessage(content=reply)]
+    await turn.history_obj.aadd_messages(new_messages)
+    schedule_summary_update(llm, req.session_id, turn.history + new_messages)
+    # La escritura en DB se encola y se hace por lotes fuera del request
+    write_behind.enqueue(TurnRecord(
+        session_id=req.session_id,
+        message=req.message,
+        reply=reply,
+        standalone=turn.standalone,
+        sources=turn.sources,
+        user_at=turn.received_at,
+        reply_at=datetime.utcnow(),
+    ))
+    if _use_semantic_cache(req) and turn.cached is None:
+        await _cache_store(req, turn, reply)
+
+@app.post("/chat")
+async def chat(req: ChatRequest, response: Response, llm: BaseChatModel = Depends(get_llm)):
+    turn = await _prepare_turn(req, llm)
+
+    # 5) Prompt final con contexto + historial (todavía NO actualizamos historial)
+    if turn.cached:
+        reply = turn.cached["reply"]
+    else:
+        prompt = answer_messages(turn.compacted.answer, turn.standalone, turn.docs)
+        with turn.timer.stage("generate"):
+            reply_msg = await llm.ainvoke(prompt)
+        record_llm_usage("answer", prompt, reply_msg)
+        reply = reply_msg.content
+
+    # 6) Historial + persistencia
+    with turn.timer.stage("finish"):
+        await _finish_turn(req, llm, turn, reply)
 
     # 7) Respuesta HTTP con fuentes coherentes a la pregunta condensada
-    sources = [{"source": d.metadata.get("source", "N/A")} for d in docs]
-    return {"reply": reply, "sources": sources}
+    observe_turn("chat", turn.timer, session=req.session_id, cached=bool(turn.cached), docs=len(turn.docs))
+    response.headers["Server-Timing"] = turn.timer.server_timing()
+    return {"reply": reply, "sources": turn.sources}
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(req: ChatRequest, llm: BaseChatModel = Depends(get_llm)):
+    """Same pipeline as /chat, but the answer is sent as Server-Sent Events.
+
+    Events: `sources` (once, before generation), `token` (one per chunk),
+    `done` (full reply and per-stage `timings` in ms) or `error`.
+    """
+    turn = await _prepare_turn(req, llm)
+
+    async def events():
+        yield _sse("sources", {"sources": turn.sources, "standalone_question": turn.standalone})
+        if turn.cached:
+            reply = turn.cached["reply"]
+            yield _sse("token", {"token": reply})
+        else:
+            prompt = answer_messages(turn.compacted.answer, turn.standalone, turn.docs)
+            message = None
+            try:
+                with turn.timer.stage("generate"):
+                    async for chunk in llm.astream(prompt):
+                        # Los chunks se suman: el mensaje final trae el uso de tokens si el proveedor lo envía
+                        message = chunk if message is None else message + chunk
+                        if chunk.content:
+                            if "first_token" not in turn.timer.stages:
+                                turn.timer.mark("first_token")
+                            yield _sse("token", {"token": chunk.content})
+            except Exception as e:
+                yield _sse("error", {"detail": str(e), "retry_after": getattr(e, "retry_after", None)})
+                return
+            reply = message.content if message is not None else ""
+            if message is not None:
+                record_llm_usage("answer", prompt, message)
+        # Solo se guarda el turno cuando la respuesta terminó de generarse
+        with turn.timer.stage("finish"):
+            await _finish_turn(req, llm, turn, reply)
+        observe_turn("chat_stream", turn.timer, session=req.session_id, cached=bool(turn.cached), docs=len(turn.docs))
+        yield _sse("done", {"reply": reply, "timings": turn.timer.as_ms()})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
+# Paginación por cursor (keyset): el cliente manda el último elemento que vio y
+# la consulta arranca desde ahí usando el índice, sin OFFSET ni cargar filas previas.
+_MESSAGE_COLUMNS = (
+    ChatMessage.id,
+    ChatMessage.session_id,
+    ChatMessage.role,
+    ChatMessage.content,
+    ChatMessage.standalone_question,
+    ChatMessage.sources_json,
+    ChatMessage.created_at,
+)
 
-from typing import Optional
-from fastapi import Query
+def _messages_stmt(session_id: str, after_id: Optional[int] = None):
+    stmt = select(*_MESSAGE_COLUMNS).where(ChatMessage.session_id == session_id)
+    if after_id is not None:
+        cursor_at = select(ChatMessage.created_at).where(ChatMessage.id == after_id).scalar_subquery()
+        stmt = stmt.where(or_(
+            ChatMessage.created_at > cursor_at,
+            and_(ChatMessage.created_at == cursor_at, ChatMessage.id > after_id),
+        ))
+    return stmt.order_by(ChatMessage.created_at.asc(), ChatMessage.id.asc())
 
 @app.get("/sessions")
-def list_sessions(limit: int = 50):
+def list_sessions(
+    response: Response,
+    limit: int = Query(50, ge=1, le=1000),
+    before: Optional[str] = Query(None, description="session_id of the last session of the previous page"),
+):
+    stmt = select(ChatSession.session_id, ChatSession.created_at)
+    if before is not None:
+        cursor_at = select(ChatSession.created_at).where(ChatSession.session_id == before).scalar_subquery()
+        stmt = stmt.where(or_(
+            ChatSession.created_at < cursor_at,
+            and_(ChatSession.created_at == cursor_at, ChatSession.session_id < before),
+        ))
+    stmt = stmt.order_by(ChatSession.created_at.desc(), ChatSession.session_id.desc()).limit(limit)
     with get_session() as s:
-        rows = s.exec("""SELECT session_id, MIN(created_at) AS created_at
-                          FROM chatsession
-                          GROUP BY session_id
-                          ORDER BY created_at DESC
-                          LIMIT :lim""", {"lim": limit}).all() if False else s.query(ChatSession).order_by(ChatSession.created_at.desc()).limit(limit).all()
-        return [{"session_id": r.session_id, "created_at": r.created_at.isoformat()} for r in rows]
+        rows = s.exec(stmt).all()
+    if len(rows) == limit:
+        response.headers["X-Next-Cursor"] = rows[-1].session_id
+    return [{"session_id": r.session_id, "created_at": r.created_at.isoformat()} for r in rows]
 
 @app.get("/session/{session_id}/messages", response_model=list[ChatMessageRead])
-def get_session_messages(session_id: str, limit: int = 200):
+def get_session_messages(
+    session_id: str,
+    response: Response,
+    limit: int = Query(200, ge=1, le=1000),
+    after_id: Optional[int] = Query(None, description="id of the last message of the previous page"),
+):
     with get_session() as s:
-        rows = s.query(ChatMessage).filter(ChatMessage.session_id==session_id).order_by(ChatMessage.created_at.asc()).limit(limit).all()
-        out = []
-        import json as _json
-        for r in rows:
-            out.append(ChatMessageRead(
-                id=r.id,
-                session_id=r.session_id,
-                role=r.role,
-                content=r.content,
-                standalone_question=r.standalone_question,
-                sources=_json.loads(r.sources_json) if r.sources_json else None,
-                created_at=r.created_at,
-            ))
-        return out
+        rows = s.exec(_messages_stmt(session_id, after_id).limit(limit)).all()
+    if len(rows) == limit:
+        response.headers["X-Next-Cursor"] = str(rows[-1].id)
+    return [
+        ChatMessageRead(
+            id=r.id,
+            session_id=r.session_id,
+            role=r.role,
+            content=r.content,
+            standalone_question=r.standalone_question,
+            sources=json.loads(r.sources_json) if r.sources_json else None,
+            created_at=r.created_at,
+        )
+        for r in rows
+    ]
+
+@app.get("/session/{session_id}/export")
+def export_session_messages(session_id: str):
+    """Stream every message of the session as NDJSON, one row at a time."""
+    def lines():
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=500).execute(_messages_stmt(session_id))
+            for r in result:
+                row = json.dumps({
+                    "id": r.id,
+                    "session_id": r.session_id,
+                    "role": r.role,
+                    "content": r.content,
+                    "standalone_question": r.standalone_question,
+                    "created_at": r.created_at.isoformat(),
+                }, ensure_ascii=False)
+                # sources_json ya es JSON válido: se inserta tal cual, sin decodificar y volver a codificar
+                yield f'{row[:-1]}, "sources": {r.sources_json or "null"}}}\n'
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
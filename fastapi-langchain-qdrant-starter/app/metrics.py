@@ -0,0 +1,129 @@
+import logging
+import uuid
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional, Sequence
+from langchain_core.messages import BaseMessage
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+from prometheus_client.core import REGISTRY, CounterMetricFamily, GaugeMetricFamily
+from .timing import StageTimer
+from .tokens import count_tokens
+from . import settings
+
+logger = logging.getLogger(__name__)
+
+# Métricas Prometheus del proceso (con varios workers de uvicorn cada uno expone las suyas)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+HTTP_SECONDS = Histogram(
+    "rag_http_request_seconds", "HTTP latency until the response headers are sent",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS)
+STAGE_SECONDS = Histogram(
+    "rag_stage_seconds", "Time spent in each chat pipeline stage",
+    ["endpoint", "stage"], buckets=LATENCY_BUCKETS)
+LLM_TOKENS = Counter(
+    "rag_llm_tokens_total", "LLM tokens per call (estimated when the provider reports no usage)",
+    ["call", "direction"])
+PERSIST_FLUSH_SECONDS = Histogram(
+    "rag_persist_flush_seconds", "Write-behind batch flush time", buckets=LATENCY_BUCKETS)
+GATEWAY_EVENTS = Counter(
+    "rag_gateway_events_total", "Upstream gateway calls, coalesced calls, rejections (429) and retries",
+    ["gateway", "event"])
+PERSIST_TURNS = Counter("rag_persist_turns_total", "Chat turns handled by the write-behind queue", ["result"])
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+def render() -> bytes:
+    return generate_latest(REGISTRY)
+
+class _CacheCollector:
+    """Hits, misses and size of the registered caches, read from their stats() at scrape time.
+
+    Hit rate in PromQL: rate(rag_cache_hits_total[5m]) / (rate(hits) + rate(misses)).
+    """
+
+    def __init__(self):
+        self.caches: Dict[str, Callable[[], Optional[Dict[str, Any]]]] = {}
+
+    def collect(self):
+        hits = CounterMetricFamily("rag_cache_hits", "Cache hits", labels=["cache"])
+        misses = CounterMetricFamily("rag_cache_misses", "Cache misses", labels=["cache"])
+        size = GaugeMetricFamily("rag_cache_entries", "Entries in the cache", labels=["cache"])
+        errors = CounterMetricFamily("rag_cache_errors", "Cache backend errors (served as misses)", labels=["cache"])
+        for name, stats_fn in list(self.caches.items()):
+            stats = stats_fn()
+            if not stats:
+                continue
+            hits.add_metric([name], stats["hits"])
+            misses.add_metric([name], stats["misses"])
+            if "size" in stats:
+                size.add_metric([name], stats["size"])
+            if "errors" in stats:
+                errors.add_metric([name], stats["errors"])
+        yield hits
+        yield misses
+        yield size
+        yield errors
+
+_caches = _CacheCollector()
+REGISTRY.register(_caches)
+
+def register_cache(name: str, stats_fn: Callable[[], Optional[Dict[str, Any]]]) -> None:
+    _caches.caches[name] = stats_fn
+
+# ---- Traza por request ----
+@dataclass
+class RequestTrace:
+    trace_id: str
+    tokens: Dict[str, int] = field(default_factory=dict)
+
+_trace: ContextVar[Optional[RequestTrace]] = ContextVar("rag_trace", default=None)
+
+def start_trace(trace_id: Optional[str] = None) -> RequestTrace:
+    """Bind a trace (the client's X-Request-ID or a new id) to the current request context."""
+    trace = RequestTrace(trace_id or uuid.uuid4().hex)
+    _trace.set(trace)
+    return trace
+
+def current_trace() -> Optional[RequestTrace]:
+    return _trace.get()
+
+class TraceIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        trace = _trace.get()
+        record.trace_id = trace.trace_id if trace else "-"
+        return True
+
+def configure_logging() -> None:
+    """Root handler whose lines carry the trace id of the request that logged them."""
+    logging.basicConfig(level=settings.LOG_LEVEL,
+                        format="%(asctime)s %(levelname)s %(name)s [%(trace_id)s] %(message)s")
+    for handler in logging.getLogger().handlers:
+        if not any(isinstance(f, TraceIdFilter) for f in handler.filters):
+            handler.addFilter(TraceIdFilter())
+
+def record_llm_usage(call: str, prompt: Sequence[BaseMessage], reply: BaseMessage) -> Dict[str, int]:
+    """Count the tokens of one LLM call: provider usage if reported, else a local estimate."""
+    usage = getattr(reply, "usage_metadata", None)
+    if usage:
+        counts = {"prompt": usage["input_tokens"], "completion": usage["output_tokens"]}
+    else:
+        counts = {"prompt": sum(count_tokens(str(m.content)) for m in prompt),
+                  "completion": count_tokens(str(reply.content))}
+    trace = _trace.get()
+    for direction, n in counts.items():
+        LLM_TOKENS.labels(call, direction).inc(n)
+        if trace is not None:
+            key = f"{call}_{direction}"
+            trace.tokens[key] = trace.tokens.get(key, 0) + n
+    return counts
+
+def observe_turn(endpoint: str, timer: StageTimer, **fields: Any) -> None:
+    """Feed the stage histograms and log the per-request breakdown."""
+    for stage, seconds in timer.stages.items():
+        STAGE_SECONDS.labels(endpoint, stage).observe(seconds)
+    ms = timer.as_ms()
+    STAGE_SECONDS.labels(endpoint, "total").observe(ms["total"] / 1000)
+    trace = _trace.get()
+    logger.info("%s stages_ms=%s tokens=%s %s", endpoint, ms, trace.tokens if trace else {},
+                " ".join(f"{k}={v}" for k, v in fields.items()))
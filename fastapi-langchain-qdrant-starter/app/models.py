@@ -1,15 +1,22 @@
 from typing import Optional, List, Any
 from datetime import datetime
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field, Relationship
 from pydantic import BaseModel
 
 class ChatSession(SQLModel, table=True):
+    # /sessions pagina por (created_at, session_id) descendente
+    __table_args__ = (Index("ix_chatsession_created_at_session_id", "created_at", "session_id"),)
+
     session_id: str = Field(primary_key=True, index=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
     messages: List["ChatMessage"] = Relationship(back_populates="session")
 
 class ChatMessage(SQLModel, table=True):
+    # Los mensajes de una sesión se listan ordenados por fecha
+    __table_args__ = (Index("ix_chatmessage_session_id_created_at", "session_id", "created_at"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     session_id: str = Field(foreign_key="chatsession.session_id", index=True)
     role: str  # 'user' o 'assistant'
@@ -20,6 +27,14 @@ class ChatMessage(SQLModel, table=True):
 
     session: Optional[ChatSession] = Relationship(back_populates="messages")
 
+class IngestManifest(SQLModel, table=True):
+    """One row per ingested file: its content hash and the Qdrant points it produced."""
+    collection: str = Field(primary_key=True)
+    source: str = Field(primary_key=True)
+    content_hash: str
+    point_ids_json: str  # JSON serializado (lista de ids de puntos)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
 # Schemas para respuestas API
 class ChatMessageRead(BaseModel):
     id: int
@@ -0,0 +1,156 @@
+import json
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from sqlalchemy import insert, select
+from sqlalchemy.engine import Engine
+from .db import engine as default_engine
+from .metrics import PERSIST_FLUSH_SECONDS, PERSIST_TURNS
+from .models import ChatMessage, ChatSession
+from . import settings
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class TurnRecord:
+    session_id: str
+    message: str
+    reply: str
+    standalone: str
+    sources: List[Dict[str, Any]]
+    user_at: datetime
+    reply_at: datetime
+
+class WriteBehindQueue:
+    """Persists chat turns off the request path.
+
+    A background thread collects queued turns and writes them in one
+    transaction per batch: a single insert-if-missing for the session rows
+    and a bulk insert for the messages. A batch is flushed when it reaches
+    `batch_size` or after `flush_interval` seconds. `stop()` drains whatever
+    is pending. Failures are logged and counted, not swallowed.
+    """
+
+    _STOP = object()
+
+    def __init__(self, engine: Engine, batch_size: int, flush_interval: float, max_queue: int):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.written_turns = 0
+        self.failed_turns = 0
+        self.dropped_turns = 0
+        self.batches = 0
+        self.last_error: Optional[str] = None
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                self._thread.start()
+
+    def enqueue(self, record: TurnRecord) -> None:
+        self.start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped_turns += 1
+            PERSIST_TURNS.labels("dropped").inc()
+            logger.error("write-behind queue full, dropping turn for session %s", record.session_id)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        batch: List[TurnRecord] = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is self._STOP:
+                self.flush(batch)
+                return
+            if item is not None:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self.flush(batch)
+                batch = []
+                deadline = None
+
+    def _insert_missing_sessions(self, conn, created_at: Dict[str, datetime]) -> None:
+        # created_at: primer mensaje de cada sesión en el lote
+        table = ChatSession.__table__
+        session_ids = sorted(created_at)
+        rows = [{"session_id": sid, "created_at": created_at[sid]} for sid in session_ids]
+        dialect = self.engine.dialect.name
+        if dialect in ("sqlite", "postgresql"):
+            if dialect == "sqlite":
+                from sqlalchemy.dialects.sqlite import insert as dialect_insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert as dialect_insert
+            conn.execute(dialect_insert(table).on_conflict_do_nothing(index_elements=["session_id"]), rows)
+            return
+        existing = set(conn.execute(select(table.c.session_id).where(table.c.session_id.in_(session_ids))).scalars())
+        missing = [r for r in rows if r["session_id"] not in existing]
+        if missing:
+            conn.execute(insert(table), missing)
+
+    def flush(self, batch: List[TurnRecord]) -> None:
+        if not batch:
+            return
+        messages = []
+        for r in batch:
+            messages.append({"session_id": r.session_id, "role": "user", "content": r.message,
+                             "standalone_question": None, "sources_json": None, "created_at": r.user_at})
+            messages.append({"session_id": r.session_id, "role": "assistant", "content": r.reply,
+                             "standalone_question": r.standalone, "sources_json": json.dumps(r.sources),
+                             "created_at": r.reply_at})
+        start = time.perf_counter()
+        try:
+            with self.engine.begin() as conn:
+                created_at: Dict[str, datetime] = {}
+                for r in batch:
+                    created_at[r.session_id] = min(r.user_at, created_at.get(r.session_id, r.user_at))
+                self._insert_missing_sessions(conn, created_at)
+                conn.execute(insert(ChatMessage.__table__), messages)
+        except Exception as e:
+            self.failed_turns += len(batch)
+            self.last_error = repr(e)
+            PERSIST_TURNS.labels("failed").inc(len(batch))
+            logger.exception("write-behind flush of %d turns failed", len(batch))
+        else:
+            self.written_turns += len(batch)
+            self.batches += 1
+            PERSIST_TURNS.labels("written").inc(len(batch))
+        PERSIST_FLUSH_SECONDS.observe(time.perf_counter() - start)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": self._queue.qsize(),
+            "written_turns": self.written_turns,
+            "failed_turns": self.failed_turns,
+            "dropped_turns": self.dropped_turns,
+            "batches": self.batches,
+            "last_error": self.last_error,
+        }
+
+write_behind = WriteBehindQueue(
+    default_engine,
+    batch_size=settings.PERSIST_BATCH_SIZE,
+    flush_interval=settings.PERSIST_FLUSH_INTERVAL,
+    max_queue=settings.PERSIST_QUEUE_SIZE,
+)
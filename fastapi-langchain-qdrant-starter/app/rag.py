@@ -0,0 +1,61 @@
+import hashlib
+from typing import List, Sequence
+from langchain_core.documents import Document
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from .cache import TTLCache
+from .metrics import record_llm_usage
+from . import settings
+
+# Prompts del pipeline conversacional (se construyen una sola vez)
+CONDENSE_PROMPT = ChatPromptTemplate.from_messages([
+    ("system",
+     "Reescribe la consulta del usuario como una pregunta independiente, breve y clara, "
+     "usando el historial si aporta contexto. Devuelve solo la pregunta reescrita."),
+    MessagesPlaceholder("history"),
+    ("human", "{question}")
+])
+
+ANSWER_PROMPT = ChatPromptTemplate.from_messages([
+    ("system",
+     "Eres un asistente experto. Responde en español con precisión y cita fuentes cuando existan. "
+     "Si no hay evidencia suficiente en el contexto, dilo explícitamente."
+     "Si la pregunta no está relacionada con el contexto responde: 'Mi objetivo es ayudarte con temas sobre los productos, nada más'"
+     "No asumas escenarios hipoteticos, no ayudes con preguntas generales."),
+    MessagesPlaceholder("history"),
+    ("human", "Pregunta: {question}\n\nContexto:\n{context}")
+])
+
+def format_docs(docs: Sequence[Document]) -> str:
+    return "\n\n".join([f"Fuente: {d.metadata.get('source', 'N/A')}\n{d.page_content}" for d in docs])
+
+def doc_sources(docs: Sequence[Document]) -> List[dict]:
+    return [{"source": d.metadata.get("source", "N/A")} for d in docs]
+
+condense_cache = TTLCache(maxsize=settings.CONDENSE_CACHE_SIZE, ttl=settings.CONDENSE_CACHE_TTL)
+
+def _condense_key(history: List[BaseMessage], question: str) -> str:
+    h = hashlib.sha256()
+    for m in history[-settings.CONDENSE_CACHE_WINDOW:]:
+        h.update(f"{m.type}\x1f{m.content}\x1e".encode())
+    h.update(question.encode())
+    return h.hexdigest()
+
+async def acondense_question(llm: BaseChatModel, history: List[BaseMessage], question: str) -> str:
+    # Sin historial (primer turno) la reescritura no aporta nada: nos ahorramos la llamada al LLM
+    if len(history) < max(settings.CONDENSE_MIN_HISTORY, 1):
+        return question
+    key = _condense_key(history, question)
+    cached = condense_cache.get(key)
+    if cached is not None:
+        return cached
+    messages = CONDENSE_PROMPT.format_messages(history=history, question=question)
+    reply = await llm.ainvoke(messages)
+    record_llm_usage("condense", messages, reply)
+    standalone = reply.content.strip() or question
+    condense_cache.set(key, standalone)
+    return standalone
+
+def answer_messages(history: List[BaseMessage], question: str, docs: Sequence[Document]) -> List[BaseMessage]:
+    return ANSWER_PROMPT.format_messages(history=history, question=question, context=format_docs(docs))
@@ -0,0 +1,133 @@
+import asyncio
+import hashlib
+import logging
+import math
+from collections import Counter
+from functools import lru_cache
+from typing import List, Optional, Sequence
+from langchain_core.documents import Document
+from .cache import TTLCache
+from .rag import format_docs
+from .sparse import BM25_B, BM25_K1, tokenize
+from .tokens import count_tokens
+from . import settings
+
+logger = logging.getLogger(__name__)
+
+RERANK_MODES = ("lexical", "cross-encoder")
+
+# Puntuación por (modo, pregunta, fragmento): preguntas repetidas no vuelven a pasar por el modelo
+score_cache = TTLCache(maxsize=settings.RERANK_CACHE_SIZE, ttl=settings.RERANK_CACHE_TTL)
+
+@lru_cache(maxsize=1)
+def _cross_encoder():
+    try:
+        from sentence_transformers import CrossEncoder
+        return CrossEncoder(settings.RERANK_MODEL, device="cpu")
+    except Exception:
+        # Sin sentence-transformers (o sin poder descargar el modelo) usamos el scorer léxico
+        logger.warning("cross-encoder %s unavailable, falling back to lexical rerank", settings.RERANK_MODEL)
+        return None
+
+def resolve_mode(enabled: Optional[bool] = None) -> str:
+    """Rerank mode for a request: `enabled` overrides RERANK_MODE ("" = off)."""
+    mode = settings.RERANK_MODE if settings.RERANK_MODE in RERANK_MODES else ""
+    if enabled is None:
+        return mode
+    return (mode or "lexical") if enabled else ""
+
+def lexical_scores(query: str, texts: Sequence[str]) -> List[float]:
+    """BM25 of the query against the candidate set (IDF computed over the candidates)."""
+    docs = [Counter(tokenize(t)) for t in texts]
+    lengths = [sum(d.values()) for d in docs]
+    avg_len = (sum(lengths) / len(docs)) or 1.0
+    terms = set(tokenize(query))
+    idf = {}
+    for term in terms:
+        df = sum(1 for d in docs if term in d)
+        idf[term] = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+    scores = []
+    for d, length in zip(docs, lengths):
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_len)
+        scores.append(sum(idf[t] * d[t] * (BM25_K1 + 1) / (d[t] + norm) for t in terms if t in d))
+    return scores
+
+def _score_key(mode: str, query: str, text: str) -> str:
+    return hashlib.sha256(f"{mode}\x1f{query}\x1f{text}".encode()).hexdigest()
+
+def score(query: str, docs: Sequence[Document], mode: str) -> List[float]:
+    """Relevance of each doc to the query; cached pairs are reused, the rest go in batches."""
+    model = _cross_encoder() if mode == "cross-encoder" else None
+    if model is None:
+        # El léxico depende del conjunto de candidatos (IDF), no se cachea por par
+        return lexical_scores(query, [d.page_content for d in docs])
+    keys = [_score_key(mode, query, d.page_content) for d in docs]
+    scores = [score_cache.get(key) for key in keys]
+    missing = [i for i, s in enumerate(scores) if s is None]
+    if missing:
+        pairs = [(query, docs[i].page_content) for i in missing]
+        for i, s in zip(missing, model.predict(pairs, batch_size=settings.RERANK_BATCH_SIZE)):
+            scores[i] = float(s)
+            score_cache.set(keys[i], scores[i])
+    return scores
+
+def _overlap(a: str, b: str, probe: int = 40) -> int:
+    # Longitud del sufijo de `a` que es prefijo de `b` (solape del splitter entre fragmentos contiguos)
+    head = b[:probe]
+    if len(head) < probe:
+        return 0
+    pos = a.find(head, max(0, len(a) - len(b)))
+    while pos != -1:
+        if b.startswith(a[pos:]):
+            return len(a) - pos
+        pos = a.find(head, pos + 1)
+    return 0
+
+def _containment(a: set, b: set) -> float:
+    return len(a & b) / (min(len(a), len(b)) or 1)
+
+def pack(docs: Sequence[Document], scores: Sequence[float], k: int, budget: int) -> List[Document]:
+    """Best `k` docs by score that fit in `budget` tokens of formatted context.
+
+    Near-duplicates (token containment >= RERANK_DEDUP_THRESHOLD) are dropped
+    and the text shared with an adjacent chunk of the same source is trimmed.
+    """
+    kept: List[Document] = []
+    kept_terms: List[set] = []
+    used = 0
+    for i in sorted(range(len(docs)), key=lambda i: scores[i], reverse=True):
+        if len(kept) >= k:
+            break
+        doc = docs[i]
+        terms = set(tokenize(doc.page_content))
+        if any(_containment(terms, other) >= settings.RERANK_DEDUP_THRESHOLD for other in kept_terms):
+            continue
+        text = doc.page_content
+        source = doc.metadata.get("source")
+        for other in kept:
+            if other.metadata.get("source") != source:
+                continue
+            text = text[_overlap(other.page_content, text):]
+            cut = _overlap(text, other.page_content)
+            if cut:
+                text = text[:-cut]
+        if not text.strip():
+            continue
+        candidate = Document(page_content=text, metadata={**doc.metadata, "rerank_score": scores[i]})
+        tokens = count_tokens(format_docs([candidate])) + 1
+        # El primero entra siempre: mejor un contexto algo largo que vacío
+        if kept and used + tokens > budget:
+            continue
+        kept.append(candidate)
+        kept_terms.append(terms)
+        used += tokens
+    return kept
+
+async def arerank(query: str, docs: Sequence[Document], k: int, mode: str,
+                  budget: Optional[int] = None) -> List[Document]:
+    """Score candidates off the event loop and pack the best into the context budget."""
+    if not docs:
+        return []
+    budget = settings.RERANK_CONTEXT_TOKENS if budget is None else budget
+    scores = await asyncio.to_thread(score, query, docs, mode)
+    return pack(docs, scores, k, budget)
@@ -0,0 +1,125 @@
+from typing import Any, Dict, List, Optional
+import numpy as np
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+from langchain_core.documents import Document
+from qdrant_client.http import models as rest
+from .cache import TTLCache
+from .deps import get_async_qdrant_client, get_embeddings
+from .sparse import SPARSE_VECTOR_NAME, encode_query
+from . import settings
+
+# Mismas claves de payload que escribe QdrantVectorStore al ingerir
+CONTENT_KEY = "page_content"
+METADATA_KEY = "metadata"
+
+def point_to_document(point: rest.ScoredPoint) -> Document:
+    payload = point.payload or {}
+    return Document(page_content=payload.get(CONTENT_KEY, ""), metadata=payload.get(METADATA_KEY) or {})
+
+def _dense_vector(point: rest.ScoredPoint) -> List[float]:
+    return point.vector.get("") if isinstance(point.vector, dict) else point.vector
+
+# Si la colección tiene vectores dispersos (puede cambiar con un reset, por eso caduca)
+_sparse_support = TTLCache(maxsize=16, ttl=60)
+
+async def collection_has_sparse(collection: str) -> bool:
+    has = _sparse_support.get(collection)
+    if has is None:
+        info = await get_async_qdrant_client().get_collection(collection)
+        has = SPARSE_VECTOR_NAME in (info.config.params.sparse_vectors or {})
+        _sparse_support.set(collection, has)
+    return has
+
+def build_filter(filters: Optional[Dict[str, Any]]) -> Optional[rest.Filter]:
+    """Metadata filter: every key must match; a list value matches any of its items."""
+    if not filters:
+        return None
+    must = []
+    for key, value in filters.items():
+        match = rest.MatchAny(any=value) if isinstance(value, list) else rest.MatchValue(value=value)
+        must.append(rest.FieldCondition(key=f"{METADATA_KEY}.{key}", match=match))
+    return rest.Filter(must=must)
+
+def search_params(ef: Optional[int] = None, rescore: Optional[bool] = None,
+                  oversampling: Optional[float] = None) -> rest.SearchParams:
+    ef = ef or settings.QDRANT_SEARCH_EF
+    oversampling = oversampling or settings.QDRANT_SEARCH_OVERSAMPLING
+    # En colecciones sin cuantización Qdrant ignora estos parámetros
+    return rest.SearchParams(
+        hnsw_ef=ef or None,
+        quantization=rest.QuantizationSearchParams(
+            rescore=settings.QDRANT_SEARCH_RESCORE if rescore is None else rescore,
+            oversampling=oversampling or None,
+        ),
+    )
+
+async def aembed_query(text: str) -> List[float]:
+    return await get_embeddings().aembed_query(text)
+
+async def asearch(
+    vector: List[float],
+    k: int,
+    *,
+    query_text: Optional[str] = None,
+    hybrid: Optional[bool] = None,
+    ef: Optional[int] = None,
+    score_threshold: Optional[float] = None,
+    filters: Optional[Dict[str, Any]] = None,
+    mmr: bool = False,
+    fetch_k: int = 20,
+    mmr_lambda: float = 0.5,
+    rescore: Optional[bool] = None,
+    oversampling: Optional[float] = None,
+) -> List[Document]:
+    """Search the configured collection using the async client.
+
+    With `hybrid` (default HYBRID_SEARCH) and a collection that stores BM25
+    vectors, a dense and a sparse search on `query_text` run as prefetches of
+    a single query and are fused with reciprocal rank fusion; otherwise the
+    search is dense only. `ef` trades recall for latency at query time (HNSW
+    beam size); `score_threshold` drops weak dense matches and, since a
+    sparse-only hit has no dense score to check, turns hybrid search off. With `mmr`,
+    `fetch_k` candidates are re-ranked for diversity with maximal marginal
+    relevance. On quantized collections, `oversampling` fetches more
+    quantized candidates and `rescore` re-ranks them with the original vectors.
+    """
+    client = get_async_qdrant_client()
+    collection = settings.QDRANT_COLLECTION
+    query_filter = build_filter(filters)
+    params = search_params(ef, rescore, oversampling)
+    limit = max(fetch_k, k) if mmr else k
+
+    sparse = encode_query(query_text) if query_text else ([], [])
+    # Los puntajes RRF no son comparables con un umbral de coseno: con score_threshold la búsqueda es densa
+    use_hybrid = (settings.HYBRID_SEARCH if hybrid is None else hybrid) and sparse[0] and score_threshold is None
+    if use_hybrid and await collection_has_sparse(collection):
+        prefetch_k = max(settings.HYBRID_PREFETCH_K, limit)
+        res = await client.query_points(
+            collection_name=collection,
+            prefetch=[
+                rest.Prefetch(query=vector, filter=query_filter, params=params, limit=prefetch_k),
+                rest.Prefetch(query=rest.SparseVector(indices=sparse[0], values=sparse[1]),
+                              using=SPARSE_VECTOR_NAME, filter=query_filter, limit=prefetch_k),
+            ],
+            query=rest.FusionQuery(fusion=rest.Fusion.RRF),
+            limit=limit,
+            with_payload=True,
+            with_vectors=mmr,
+        )
+    else:
+        res = await client.query_points(
+            collection_name=collection,
+            query=vector,
+            query_filter=query_filter,
+            search_params=params,
+            score_threshold=score_threshold,
+            limit=limit,
+            with_payload=True,
+            with_vectors=mmr,
+        )
+    points = res.points
+    if mmr and points:
+        picked = maximal_marginal_relevance(
+            np.array(vector), [_dense_vector(p) for p in points], lambda_mult=mmr_lambda, k=k)
+        points = [points[i] for i in picked]
+    return [point_to_document(p) for p in points]
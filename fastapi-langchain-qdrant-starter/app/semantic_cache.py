@@ -0,0 +1,237 @@
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+import numpy as np
+from qdrant_client.http import models as rest
+from qdrant_client.http.exceptions import UnexpectedResponse
+from .deps import get_async_qdrant_client, get_qdrant_client
+from . import settings
+
+class SemanticCache:
+    """Answers indexed by the embedding of the condensed question.
+
+    A lookup returns the stored reply/sources of the most similar prior
+    question if its cosine similarity is >= `threshold` and it was asked with
+    the same retrieval `key` (k and every retrieval setting that changes the
+    answer). Subclasses implement `_lookup`, `_store` and `_clear`.
+    """
+
+    def __init__(self, threshold: float, ttl: float, max_entries: int):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0  # fallos del backend; el turno sigue como si fuera un miss
+
+    async def alookup(self, vector: List[float], key: str) -> Optional[Dict[str, Any]]:
+        found = await self._lookup(vector, key)
+        if found is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return found
+
+    async def astore(self, vector: List[float], key: str, question: str, reply: str, sources: List[Dict[str, Any]]) -> None:
+        await self._store(vector, {"key": key, "question": question, "reply": reply, "sources": sources, "created_at": time.time()})
+
+    def invalidate(self) -> None:
+        """Drop every cached answer (the indexed documents changed)."""
+        self._clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "backend": self.backend,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+class InMemorySemanticCache(SemanticCache):
+    """Ring buffer of `max_entries` normalized vectors, allocated once.
+
+    A store overwrites the oldest slot; expired slots are masked at lookup
+    time instead of being removed, so no store copies the matrix.
+    """
+
+    backend = "memory"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+        self._vectors: Optional[np.ndarray] = None  # (max_entries, dim), se reserva en el primer store
+        self._created = np.full(max(self.max_entries, 0), -np.inf)  # -inf = slot libre
+        self._entries: List[Optional[Dict[str, Any]]] = [None] * max(self.max_entries, 0)
+        self._cursor = 0  # próximo slot a escribir
+        self._filled = 0  # slots escritos alguna vez (prefijo del buffer)
+
+    def _alive(self, now: float) -> np.ndarray:
+        created = self._created[:self._filled]
+        return created >= now - self.ttl if self.ttl else created > -np.inf
+
+    async def _lookup(self, vector, key):
+        q = np.asarray(vector, dtype=np.float32)
+        q /= np.linalg.norm(q) or 1.0
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != q.shape[0]:
+                return None
+            scores = self._vectors[:self._filled] @ q
+            scores[~self._alive(time.time())] = -np.inf
+            candidates = np.flatnonzero(scores >= self.threshold)
+            for i in candidates[np.argsort(-scores[candidates])]:
+                if self._entries[i]["key"] == key:
+                    return self._entries[i]
+        return None
+
+    async def _store(self, vector, entry):
+        if self.max_entries <= 0:
+            return
+        v = np.asarray(vector, dtype=np.float32)
+        v /= np.linalg.norm(v) or 1.0
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != v.shape[0]:
+                # Primer store (o cambió la dimensión del modelo de embeddings)
+                self._vectors = np.zeros((self.max_entries, v.shape[0]), dtype=np.float32)
+                self._reset()
+            i = self._cursor
+            self._vectors[i] = v
+            self._created[i] = entry["created_at"]
+            self._entries[i] = entry
+            self._cursor = (i + 1) % self.max_entries
+            self._filled = max(self._filled, i + 1)
+
+    def _reset(self) -> None:
+        self._created[:] = -np.inf
+        self._entries = [None] * len(self._entries)
+        self._cursor = self._filled = 0
+
+    def _clear(self):
+        with self._lock:
+            self._reset()
+
+    def stats(self):
+        with self._lock:
+            size = int(np.count_nonzero(self._alive(time.time())))
+        return {**super().stats(), "size": size, "max_entries": self.max_entries}
+
+def _collection_missing(exc: Exception) -> bool:
+    # Remoto: 404; modo local (QDRANT_LOCATION): ValueError "Collection ... not found"
+    if isinstance(exc, UnexpectedResponse):
+        return exc.status_code == 404
+    return isinstance(exc, ValueError) and "not found" in str(exc)
+
+class QdrantSemanticCache(SemanticCache):
+    """Cache stored in its own Qdrant collection, shared by every worker."""
+
+    backend = "qdrant"
+
+    def __init__(self, *args, collection: str, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.collection = collection
+        self._ready = False
+        self._writes = 0
+
+    async def _ensure_collection(self, dimension: int) -> None:
+        if self._ready:
+            return
+        client = get_async_qdrant_client()
+        if not await client.collection_exists(self.collection):
+            try:
+                await client.create_collection(
+                    collection_name=self.collection,
+                    vectors_config=rest.VectorParams(size=dimension, distance=rest.Distance.COSINE),
+                )
+            except Exception:
+                # Otro worker pudo crearla al mismo tiempo
+                if not await client.collection_exists(self.collection):
+                    raise
+            await client.create_payload_index(self.collection, "key", rest.PayloadSchemaType.KEYWORD)
+            await client.create_payload_index(self.collection, "created_at", rest.PayloadSchemaType.FLOAT)
+        self._ready = True
+
+    async def _lookup(self, vector, key):
+        client = get_async_qdrant_client()
+        if not self._ready and not await client.collection_exists(self.collection):
+            return None
+        try:
+            return await self._query(client, vector, key)
+        except Exception as e:
+            # Otro worker invalidó la caché (borró la colección): es un miss y se recrea al guardar
+            if not _collection_missing(e):
+                raise
+            self._ready = False
+            return None
+
+    async def _query(self, client, vector, key):
+        must = [rest.FieldCondition(key="key", match=rest.MatchValue(value=key))]
+        if self.ttl:
+            must.append(rest.FieldCondition(key="created_at", range=rest.Range(gte=time.time() - self.ttl)))
+        res = await client.query_points(
+            collection_name=self.collection,
+            query=vector,
+            query_filter=rest.Filter(must=must),
+            score_threshold=self.threshold,
+            limit=1,
+            with_payload=True,
+        )
+        return res.points[0].payload if res.points else None
+
+    async def _store(self, vector, entry):
+        point = rest.PointStruct(id=str(uuid.uuid4()), vector=vector, payload=entry)
+        await self._ensure_collection(len(vector))
+        client = get_async_qdrant_client()
+        try:
+            await client.upsert(collection_name=self.collection, points=[point], wait=False)
+        except Exception as e:
+            if not _collection_missing(e):
+                raise
+            # Borrada por la invalidación de otro worker: se recrea y se reintenta una vez
+            self._ready = False
+            await self._ensure_collection(len(vector))
+            await client.upsert(collection_name=self.collection, points=[point], wait=False)
+        # La limpieza (TTL + tamaño) se hace cada tanto, no en cada escritura
+        self._writes += 1
+        if self._writes % 100 == 0:
+            await self._evict(entry["created_at"])
+
+    async def _evict(self, now: float) -> None:
+        client = get_async_qdrant_client()
+        if self.ttl:
+            await client.delete(self.collection, points_selector=rest.FilterSelector(filter=rest.Filter(
+                must=[rest.FieldCondition(key="created_at", range=rest.Range(lt=now - self.ttl))]
+            )))
+        count = (await client.count(self.collection, exact=False)).count
+        if count > self.max_entries:
+            oldest, _ = await client.scroll(
+                self.collection,
+                limit=count - self.max_entries,
+                order_by=rest.OrderBy(key="created_at", direction=rest.Direction.ASC),
+                with_payload=False,
+            )
+            await client.delete(self.collection, points_selector=rest.PointIdsList(points=[p.id for p in oldest]))
+
+    def _clear(self):
+        client = get_qdrant_client()
+        if client.collection_exists(self.collection):
+            client.delete_collection(self.collection)
+        self._ready = False
+
+def _build_cache() -> Optional[SemanticCache]:
+    kwargs = dict(
+        threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+        ttl=settings.SEMANTIC_CACHE_TTL,
+        max_entries=settings.SEMANTIC_CACHE_MAX_ENTRIES,
+    )
+    if settings.SEMANTIC_CACHE_BACKEND == "memory":
+        return InMemorySemanticCache(**kwargs)
+    if settings.SEMANTIC_CACHE_BACKEND == "qdrant":
+        return QdrantSemanticCache(collection=settings.SEMANTIC_CACHE_COLLECTION, **kwargs)
+    if settings.SEMANTIC_CACHE_BACKEND:
+        raise RuntimeError(f"Unknown SEMANTIC_CACHE_BACKEND: {settings.SEMANTIC_CACHE_BACKEND}")
+    return None
+
+# None cuando la caché está desactivada
+semantic_cache: Optional[SemanticCache] = _build_cache()
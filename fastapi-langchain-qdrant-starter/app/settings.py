@@ -6,10 +6,124 @@ def get_env(name: str, default: str | None = None, required: bool = False) -> st
         raise RuntimeError(f"Missing required env var: {name}")
     return val
 
-OPENAI_API_KEY = get_env("OPENAI_API_KEY", required=True)
+# Proveedores de LLM y embeddings: "openai" o "fake" (deterministas, sin red; para tests y benchmarks)
+LLM_PROVIDER = get_env("LLM_PROVIDER", "openai").strip().lower()
+EMBEDDING_PROVIDER = get_env("EMBEDDING_PROVIDER", LLM_PROVIDER).strip().lower()
+OPENAI_API_KEY = get_env("OPENAI_API_KEY", required="openai" in (LLM_PROVIDER, EMBEDDING_PROVIDER))
 OPENAI_MODEL = get_env("OPENAI_MODEL", "gpt-4o-mini")
 EMBEDDING_MODEL = get_env("EMBEDDING_MODEL", "text-embedding-3-small")
 
+# Qdrant local en proceso: ":memory:" o un directorio (vacío = servidor en QDRANT_HOST:QDRANT_PORT)
+QDRANT_LOCATION = get_env("QDRANT_LOCATION", "").strip()
 QDRANT_HOST = get_env("QDRANT_HOST", "localhost")
 QDRANT_PORT = int(get_env("QDRANT_PORT", "6333"))
 QDRANT_COLLECTION = get_env("QDRANT_COLLECTION", "docs")
+QDRANT_TIMEOUT = int(get_env("QDRANT_TIMEOUT", "30"))
+QDRANT_MAX_CONNECTIONS = int(get_env("QDRANT_MAX_CONNECTIONS", "50"))
+
+# Pool HTTP compartido por los clientes de OpenAI (LLM + embeddings)
+HTTP_MAX_CONNECTIONS = int(get_env("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(get_env("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(get_env("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_TIMEOUT = float(get_env("HTTP_TIMEOUT", "60"))
+
+# Condensación de la pregunta: se omite si el historial tiene menos mensajes que el umbral
+CONDENSE_MIN_HISTORY = int(get_env("CONDENSE_MIN_HISTORY", "1"))
+CONDENSE_CACHE_SIZE = int(get_env("CONDENSE_CACHE_SIZE", "1024"))
+CONDENSE_CACHE_TTL = float(get_env("CONDENSE_CACHE_TTL", "600"))
+CONDENSE_CACHE_WINDOW = int(get_env("CONDENSE_CACHE_WINDOW", "6"))
+
+# Caché semántica de respuestas: "" (desactivada), "memory" o "qdrant"
+SEMANTIC_CACHE_BACKEND = get_env("SEMANTIC_CACHE_BACKEND", "").strip().lower()
+SEMANTIC_CACHE_THRESHOLD = float(get_env("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_TTL = float(get_env("SEMANTIC_CACHE_TTL", "3600"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(get_env("SEMANTIC_CACHE_MAX_ENTRIES", "5000"))
+SEMANTIC_CACHE_COLLECTION = get_env("SEMANTIC_CACHE_COLLECTION", f"{QDRANT_COLLECTION}_answer_cache")
+
+# Caché de embeddings: chunks en SQLite (vacío = desactivada) y consultas en memoria
+EMBEDDING_CACHE_PATH = get_env("EMBEDDING_CACHE_PATH", "./data/embedding_cache.db")
+QUERY_EMBEDDING_CACHE_SIZE = int(get_env("QUERY_EMBEDDING_CACHE_SIZE", "2048"))
+QUERY_EMBEDDING_CACHE_TTL = float(get_env("QUERY_EMBEDDING_CACHE_TTL", "3600"))
+
+# Ingesta: procesos para trocear, tamaño de lote y lotes de embeddings en vuelo
+INGEST_SPLIT_WORKERS = int(get_env("INGEST_SPLIT_WORKERS", str(min(4, os.cpu_count() or 1))))
+INGEST_BATCH_SIZE = int(get_env("INGEST_BATCH_SIZE", "64"))
+INGEST_EMBED_CONCURRENCY = int(get_env("INGEST_EMBED_CONCURRENCY", "4"))
+
+# Historial en Redis si REDIS_URL está definido (pool compartido; TTL 0 = sin expiración)
+REDIS_URL = get_env("REDIS_URL", "").strip()
+REDIS_MAX_CONNECTIONS = int(get_env("REDIS_MAX_CONNECTIONS", "50"))
+HISTORY_REDIS_TTL = int(get_env("HISTORY_REDIS_TTL", "0"))
+
+# Historial en memoria (sin REDIS_URL): sesiones máximas, expiración por inactividad y
+# mensajes por sesión (el tope de mensajes también aplica a Redis vía LTRIM)
+HISTORY_MAX_SESSIONS = int(get_env("HISTORY_MAX_SESSIONS", "10000"))
+HISTORY_IDLE_TTL = float(get_env("HISTORY_IDLE_TTL", "3600"))
+HISTORY_MAX_MESSAGES = int(get_env("HISTORY_MAX_MESSAGES", "50"))
+
+# Ventana de historial por presupuesto de tokens (0 = historial completo) y resumen acumulado opcional
+CONDENSE_HISTORY_TOKENS = int(get_env("CONDENSE_HISTORY_TOKENS", "1000"))
+ANSWER_HISTORY_TOKENS = int(get_env("ANSWER_HISTORY_TOKENS", "3000"))
+HISTORY_SUMMARY_ENABLED = get_env("HISTORY_SUMMARY_ENABLED", "false").lower() in ("1", "true", "yes")
+HISTORY_SUMMARY_MAX_WORDS = int(get_env("HISTORY_SUMMARY_MAX_WORDS", "200"))
+HISTORY_SUMMARY_MIN_MESSAGES = int(get_env("HISTORY_SUMMARY_MIN_MESSAGES", "4"))
+
+# Persistencia write-behind de mensajes en DB: tamaño de lote, intervalo de vaciado y cola máxima
+PERSIST_BATCH_SIZE = int(get_env("PERSIST_BATCH_SIZE", "200"))
+PERSIST_FLUSH_INTERVAL = float(get_env("PERSIST_FLUSH_INTERVAL", "0.5"))
+PERSIST_QUEUE_SIZE = int(get_env("PERSIST_QUEUE_SIZE", "10000"))
+
+# Índice HNSW de la colección (al crearla) y `ef` por defecto en búsqueda (0 = el del servidor)
+QDRANT_HNSW_M = int(get_env("QDRANT_HNSW_M", "16"))
+QDRANT_HNSW_EF_CONSTRUCT = int(get_env("QDRANT_HNSW_EF_CONSTRUCT", "100"))
+QDRANT_INDEXING_THRESHOLD = int(get_env("QDRANT_INDEXING_THRESHOLD", "20000"))
+QDRANT_SEARCH_EF = int(get_env("QDRANT_SEARCH_EF", "0"))
+
+# Cuantización ("", "scalar" o "binary") y almacenamiento en disco de la colección;
+# en búsqueda: re-score con los vectores originales y sobre-muestreo (0 = el del servidor)
+QDRANT_QUANTIZATION = get_env("QDRANT_QUANTIZATION", "").strip().lower()
+QDRANT_ON_DISK = get_env("QDRANT_ON_DISK", "false").lower() in ("1", "true", "yes")
+QDRANT_ON_DISK_PAYLOAD = get_env("QDRANT_ON_DISK_PAYLOAD", "false").lower() in ("1", "true", "yes")
+QDRANT_SEARCH_RESCORE = get_env("QDRANT_SEARCH_RESCORE", "true").lower() in ("1", "true", "yes")
+QDRANT_SEARCH_OVERSAMPLING = float(get_env("QDRANT_SEARCH_OVERSAMPLING", "0"))
+
+# Búsqueda híbrida: vectores dispersos BM25 (calculados localmente) + densos, fusionados con RRF
+SPARSE_VECTORS = get_env("SPARSE_VECTORS", "true").lower() in ("1", "true", "yes")
+HYBRID_SEARCH = get_env("HYBRID_SEARCH", "true").lower() in ("1", "true", "yes")
+HYBRID_PREFETCH_K = int(get_env("HYBRID_PREFETCH_K", "20"))
+SPARSE_AVG_DOC_TOKENS = float(get_env("SPARSE_AVG_DOC_TOKENS", "130"))
+
+# Re-ranking de candidatos antes del prompt ("" = desactivado, "lexical" o "cross-encoder")
+# y presupuesto de tokens del contexto (los fragmentos solapados se deduplican)
+RERANK_MODE = get_env("RERANK_MODE", "").strip().lower()
+RERANK_MODEL = get_env("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_CANDIDATES = int(get_env("RERANK_CANDIDATES", "20"))
+RERANK_BATCH_SIZE = int(get_env("RERANK_BATCH_SIZE", "16"))
+RERANK_CONTEXT_TOKENS = int(get_env("RERANK_CONTEXT_TOKENS", "1500"))
+RERANK_DEDUP_THRESHOLD = float(get_env("RERANK_DEDUP_THRESHOLD", "0.8"))
+RERANK_CACHE_SIZE = int(get_env("RERANK_CACHE_SIZE", "4096"))
+RERANK_CACHE_TTL = int(get_env("RERANK_CACHE_TTL", "3600"))
+
+# Proveedores fake: latencia simulada (segundos) y forma de las salidas
+FAKE_LLM_LATENCY = float(get_env("FAKE_LLM_LATENCY", "0.2"))
+FAKE_LLM_TOKEN_LATENCY = float(get_env("FAKE_LLM_TOKEN_LATENCY", "0.01"))
+FAKE_LLM_REPLY_TOKENS = int(get_env("FAKE_LLM_REPLY_TOKENS", "60"))
+FAKE_EMBEDDING_LATENCY = float(get_env("FAKE_EMBEDDING_LATENCY", "0.05"))
+FAKE_EMBEDDING_DIM = int(get_env("FAKE_EMBEDDING_DIM", "1536"))
+
+# Logs (cada línea lleva el trace id del request; X-Request-ID si el cliente lo envía)
+LOG_LEVEL = get_env("LOG_LEVEL", "INFO").strip().upper()
+
+# Gateway de llamadas al proveedor (LLM y embeddings): de-duplicación de peticiones idénticas en
+# vuelo, límites por minuto (0 = sin límite), cola acotada (429 + Retry-After) y reintentos con jitter
+LLM_GATEWAY = get_env("LLM_GATEWAY", "true").lower() in ("1", "true", "yes")
+LLM_RPM = int(get_env("LLM_RPM", "500"))
+LLM_TPM = int(get_env("LLM_TPM", "200000"))
+LLM_EXPECTED_COMPLETION_TOKENS = int(get_env("LLM_EXPECTED_COMPLETION_TOKENS", "300"))
+EMBEDDING_RPM = int(get_env("EMBEDDING_RPM", "3000"))
+EMBEDDING_TPM = int(get_env("EMBEDDING_TPM", "1000000"))
+GATEWAY_MAX_QUEUE = int(get_env("GATEWAY_MAX_QUEUE", "100"))
+GATEWAY_MAX_WAIT = float(get_env("GATEWAY_MAX_WAIT", "10"))
+GATEWAY_MAX_RETRIES = int(get_env("GATEWAY_MAX_RETRIES", "3"))
+GATEWAY_RETRY_BASE = float(get_env("GATEWAY_RETRY_BASE", "0.5"))
+GATEWAY_RETRY_MAX = float(get_env("GATEWAY_RETRY_MAX", "8"))
@@ -0,0 +1,50 @@
+import hashlib
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Tuple
+from . import settings
+
+# Nombre del vector disperso en la colección (el denso es el vector sin nombre "")
+SPARSE_VECTOR_NAME = "bm25"
+
+# Palabras y códigos: "AB-123.4" se conserva entero y además se indexan sus partes
+_TOKEN_RE = re.compile(r"\w+(?:[-./]\w+)*", re.UNICODE)
+_PART_RE = re.compile(r"[-./]")
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+def _fold(text: str) -> str:
+    # minúsculas y sin tildes: "devolución" y "devolucion" son el mismo término
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+def tokenize(text: str) -> List[str]:
+    tokens: List[str] = []
+    for token in _TOKEN_RE.findall(_fold(text)):
+        tokens.append(token)
+        if _PART_RE.search(token):
+            tokens.extend(p for p in _PART_RE.split(token) if p)
+    return tokens
+
+def token_index(token: str) -> int:
+    # Hashing trick: índice estable entre procesos sin mantener un vocabulario
+    return int.from_bytes(hashlib.blake2b(token.encode(), digest_size=4).digest(), "big") & 0x7FFFFFFF
+
+def _to_sparse(weights: Dict[int, float]) -> Tuple[List[int], List[float]]:
+    indices = sorted(weights)
+    return indices, [weights[i] for i in indices]
+
+def encode_document(text: str) -> Tuple[List[int], List[float]]:
+    """BM25 term-frequency weights; Qdrant applies the IDF part (Modifier.IDF)."""
+    tokens = tokenize(text)
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * len(tokens) / settings.SPARSE_AVG_DOC_TOKENS)
+    weights: Dict[int, float] = {}
+    for token, tf in Counter(tokens).items():
+        idx = token_index(token)
+        weights[idx] = weights.get(idx, 0.0) + tf * (BM25_K1 + 1) / (tf + norm)
+    return _to_sparse(weights)
+
+def encode_query(text: str) -> Tuple[List[int], List[float]]:
+    return _to_sparse({token_index(t): 1.0 for t in set(tokenize(text))})
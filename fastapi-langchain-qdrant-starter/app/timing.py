@@ -0,0 +1,30 @@
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+class StageTimer:
+    """Wall-clock time of the named stages of one request, in seconds."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def mark(self, name: str) -> None:
+        """Record the time elapsed since the request started (e.g. first token)."""
+        self.stages[name] = time.perf_counter() - self.started
+
+    def as_ms(self) -> Dict[str, float]:
+        stages = {**self.stages, "total": time.perf_counter() - self.started}
+        return {name: round(seconds * 1000, 2) for name, seconds in stages.items()}
+
+    def server_timing(self) -> str:
+        # Cabecera estándar Server-Timing: la ven el navegador (DevTools) y el benchmark
+        return ", ".join(f"{name};dur={ms}" for name, ms in self.as_ms().items())
@@ -0,0 +1,16 @@
+from functools import lru_cache
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # Sin tiktoken (o sin poder descargar el BPE) usamos la aproximación de ~4 caracteres por token
+        return None
+
+def count_tokens(text: str) -> int:
+    enc = _encoding()
+    if enc is None:
+        return (len(text) + 3) // 4
+    return len(enc.encode(text, disallowed_special=()))
@@ -0,0 +1,195 @@
+"""Per-stage latency of /chat and /ingest at fixed concurrency levels.
+
+By default the app runs in-process with the fake LLM/embedding providers and
+an in-memory Qdrant, so it needs no network, API key or running services:
+
+    python bench/chat_benchmark.py --docs 200 --concurrency 1,4,16 --requests 200
+
+Against a running server (with whatever providers it was started with; the
+ingest path must exist on the server):
+
+    python bench/chat_benchmark.py --url http://localhost:8000 --ingest-path data/docs
+
+Stage times (history, condense, embed, search, generate, ...) come from the
+Server-Timing header of /chat; `client` is the latency seen by the benchmark.
+/ingest jobs run one at a time (one job per collection) and report wall time
+and throughput. Use --json to keep the numbers and diff them between commits.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import numpy as np
+
+PRODUCTS = ["router", "cámara", "altavoz", "termostato", "enchufe", "sensor", "bombilla", "timbre"]
+TOPICS = ["garantía", "devolución", "instalación", "consumo", "compatibilidad", "envío", "reinicio", "firmware"]
+
+def make_docs(path: Path, n: int, seed: int) -> None:
+    # Documentos sintéticos con vocabulario compartido: las preguntas encuentran candidatos
+    rng = random.Random(seed)
+    path.mkdir(parents=True, exist_ok=True)
+    for i in range(n):
+        product = PRODUCTS[i % len(PRODUCTS)]
+        lines = [f"# {product.title()} modelo XK-{1000 + i}", ""]
+        for topic in rng.sample(TOPICS, 4):
+            words = rng.choices(TOPICS + PRODUCTS + ["el", "de", "para", "con", "sin", "días", "meses"], k=120)
+            lines += [f"## {topic.title()}", f"La {topic} del {product} XK-{1000 + i}: " + " ".join(words), ""]
+        (path / f"doc_{i:05d}.md").write_text("\n".join(lines), encoding="utf-8")
+
+def make_questions(n: int, docs: int, seed: int) -> List[str]:
+    rng = random.Random(seed)
+    return [f"¿Cómo funciona la {rng.choice(TOPICS)} del {rng.choice(PRODUCTS)} XK-{1000 + rng.randrange(max(docs, 1))}?"
+            for _ in range(n)]
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+    stages: Dict[str, float] = {}
+    for part in header.split(","):
+        name, _, rest = part.strip().partition(";")
+        if name and rest.startswith("dur="):
+            stages[name] = float(rest[4:])
+    return stages
+
+def summarize(samples: List[Dict[str, float]]) -> Dict[str, Dict[str, float]]:
+    by_stage: Dict[str, List[float]] = {}
+    for sample in samples:
+        for stage, ms in sample.items():
+            by_stage.setdefault(stage, []).append(ms)
+    out = {}
+    for stage, values in by_stage.items():
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        out[stage] = {"n": len(values), "p50": round(p50, 2), "p95": round(p95, 2), "p99": round(p99, 2)}
+    return out
+
+def print_table(title: str, summary: Dict[str, Dict[str, float]]) -> None:
+    print(f"\n{title}")
+    print(f"{'stage':<16}{'n':>6}{'p50 ms':>12}{'p95 ms':>12}{'p99 ms':>12}")
+    for stage, s in summary.items():
+        print(f"{stage:<16}{s['n']:>6}{s['p50']:>12.2f}{s['p95']:>12.2f}{s['p99']:>12.2f}")
+
+async def run_chat(client, questions: List[str], concurrency: int, requests: int,
+                   sessions: int, k: int) -> Dict[str, Any]:
+    samples: List[Dict[str, float]] = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker() -> None:
+        nonlocal errors
+        for i in counter:
+            body = {"session_id": f"bench-{concurrency}-{i % sessions}", "message": questions[i % len(questions)], "k": k}
+            start = time.perf_counter()
+            res = await client.post("/chat", json=body)
+            client_ms = (time.perf_counter() - start) * 1000
+            if res.status_code != 200:
+                errors += 1
+                continue
+            samples.append({**parse_server_timing(res.headers.get("server-timing", "")), "client": client_ms})
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round(len(samples) / wall, 2),
+        "stages": summarize(samples),
+    }
+
+async def run_ingest(client, path: str, runs: int, reset: bool) -> Dict[str, Any]:
+    samples: List[Dict[str, float]] = []
+    reports = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        res = await client.post("/ingest", json={"path": path, "reset": reset})
+        res.raise_for_status()
+        job = res.json()
+        while job["status"] in ("queued", "running"):
+            await asyncio.sleep(0.05)
+            job = (await client.get(f"/ingest/{job['job_id']}")).json()
+        if job["status"] != "succeeded":
+            raise RuntimeError(f"ingest job {job['job_id']} {job['status']}: {job['error']}")
+        samples.append({"client": (time.perf_counter() - start) * 1000, "job": job["report"]["elapsed_s"] * 1000})
+        reports.append(job["report"])
+    return {"runs": runs, "stages": summarize(samples), "last_report": reports[-1] if reports else None}
+
+def _use_offline_defaults(tmp: Path) -> None:
+    # Antes de importar la app: fakes, Qdrant en memoria, DB y cachés desechables
+    defaults = {
+        "LLM_PROVIDER": "fake",
+        "EMBEDDING_PROVIDER": "fake",
+        "QDRANT_LOCATION": ":memory:",
+        "DATABASE_URL": f"sqlite:///{tmp / 'bench.db'}",
+        "EMBEDDING_CACHE_PATH": "",
+        "REDIS_URL": "",
+        "LOG_LEVEL": "WARNING",  # el log por request ensuciaría la tabla
+    }
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+
+async def main(args: argparse.Namespace) -> Dict[str, Any]:
+    import httpx
+
+    tmp = Path(tempfile.mkdtemp(prefix="chat-bench-"))
+    ingest_path = args.ingest_path
+    if ingest_path is None:
+        ingest_path = str(tmp / "docs")
+        make_docs(Path(ingest_path), args.docs, args.seed)
+
+    app = None
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+    else:
+        _use_offline_defaults(tmp)
+        sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+        from app.main import app
+        await app.router.startup()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=args.timeout)
+
+    results: Dict[str, Any] = {"ingest": None, "chat": []}
+    try:
+        if args.ingest_runs:
+            results["ingest"] = await run_ingest(client, ingest_path, args.ingest_runs, reset=not args.incremental)
+            print_table(f"/ingest runs={args.ingest_runs}", results["ingest"]["stages"])
+        questions = make_questions(args.questions, args.docs, args.seed)
+        for level in args.concurrency:
+            if args.warmup:
+                await run_chat(client, questions, level, args.warmup, args.sessions, args.k)
+            res = await run_chat(client, questions, level, args.requests, args.sessions, args.k)
+            results["chat"].append(res)
+            print_table(f"/chat concurrency={level} requests={args.requests} errors={res['errors']} "
+                        f"throughput={res['throughput_rps']} req/s", res["stages"])
+    finally:
+        await client.aclose()
+        if app is not None:
+            await app.router.shutdown()
+    return results
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="running server; default runs the app in-process with fakes")
+    parser.add_argument("--concurrency", type=lambda s: [int(x) for x in s.split(",")], default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=100, help="/chat requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=10, help="unmeasured requests before each level")
+    parser.add_argument("--sessions", type=int, default=20, help="distinct session ids (history grows per session)")
+    parser.add_argument("--questions", type=int, default=50, help="distinct questions (repeats hit the caches)")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--docs", type=int, default=100, help="synthetic documents to generate")
+    parser.add_argument("--ingest-path", help="ingest this path instead of synthetic documents")
+    parser.add_argument("--ingest-runs", type=int, default=1, help="0 skips /ingest (collection must exist)")
+    parser.add_argument("--incremental", action="store_true", help="don't reset the collection between runs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--json", help="write the results to this file")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = asyncio.run(main(args))
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding="utf-8")
@@ -0,0 +1,133 @@
+"""Recall@k vs latency vs memory for Qdrant quantization / on-disk settings.
+
+Creates one throwaway collection per configuration on a local Qdrant, loads
+the same synthetic (clustered) vectors into each, and compares approximate
+search against exact search on the full-precision baseline.
+
+    python bench/quantization_benchmark.py --host localhost --points 50000 --dim 1536
+
+Memory is an estimate of what each configuration keeps in RAM (original
+vectors unless on_disk, plus the quantized copy); HNSW graph and payloads
+are the same for every configuration and are left out.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.http import models as rest
+
+# Misma configuración de cuantización que crea la ingesta; solo se importa la app (sin proveedores ni API key)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("LLM_PROVIDER", "fake")
+from app.ingest import quantization_config
+
+CONFIGS: Dict[str, Dict] = {
+    "float32": {"quantization": None, "on_disk": False},
+    "float32+disk": {"quantization": None, "on_disk": True},
+    "scalar": {"quantization": "scalar", "on_disk": False},
+    "scalar+disk": {"quantization": "scalar", "on_disk": True},
+    "binary": {"quantization": "binary", "on_disk": False},
+    "binary+disk": {"quantization": "binary", "on_disk": True},
+}
+
+def ram_bytes(n: int, dim: int, mode: Optional[str], on_disk: bool) -> int:
+    original = 0 if on_disk else n * dim * 4
+    quantized = {"scalar": n * dim, "binary": n * dim // 8}.get(mode, 0)
+    return original + quantized
+
+def make_vectors(n: int, dim: int, clusters: int, rng: np.random.Generator) -> np.ndarray:
+    # Mezcla de gaussianas: más parecido a embeddings reales que ruido uniforme
+    centers = rng.normal(size=(clusters, dim))
+    data = centers[rng.integers(0, clusters, size=n)] + 0.35 * rng.normal(size=(n, dim))
+    data /= np.linalg.norm(data, axis=1, keepdims=True)
+    return data.astype(np.float32)
+
+def wait_green(client: QdrantClient, name: str, timeout: float = 600) -> None:
+    deadline = time.monotonic() + timeout
+    while client.get_collection(name).status != rest.CollectionStatus.GREEN:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"{name} not indexed after {timeout}s")
+        time.sleep(0.5)
+
+def load(client: QdrantClient, name: str, data: np.ndarray, cfg: Dict, batch: int) -> None:
+    if client.collection_exists(name):
+        client.delete_collection(name)
+    client.create_collection(
+        collection_name=name,
+        vectors_config=rest.VectorParams(size=data.shape[1], distance=rest.Distance.COSINE, on_disk=cfg["on_disk"]),
+        quantization_config=quantization_config(cfg["quantization"] or ""),
+    )
+    for start in range(0, len(data), batch):
+        chunk = data[start:start + batch]
+        client.upsert(name, points=rest.Batch(ids=list(range(start, start + len(chunk))), vectors=chunk.tolist()), wait=False)
+    wait_green(client, name)
+
+def search_ids(client: QdrantClient, name: str, q: np.ndarray, k: int, params: rest.SearchParams) -> List[int]:
+    res = client.query_points(name, query=q.tolist(), limit=k, search_params=params, with_payload=False)
+    return [p.id for p in res.points]
+
+def percentile(values: List[float], p: float) -> float:
+    return float(np.percentile(values, p)) if values else 0.0
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=6333)
+    parser.add_argument("--location", default=None, help="e.g. ':memory:' (local mode ignores quantization)")
+    parser.add_argument("--points", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--clusters", type=int, default=64)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--ef", type=int, default=128)
+    parser.add_argument("--oversampling", type=float, nargs="*", default=[1.0, 2.0, 4.0])
+    parser.add_argument("--batch", type=int, default=512)
+    parser.add_argument("--configs", nargs="*", default=list(CONFIGS), choices=list(CONFIGS))
+    parser.add_argument("--keep", action="store_true", help="don't delete the benchmark collections")
+    args = parser.parse_args()
+
+    client = QdrantClient(location=args.location) if args.location else QdrantClient(host=args.host, port=args.port, timeout=120)
+    rng = np.random.default_rng(0)
+    data = make_vectors(args.points, args.dim, args.clusters, rng)
+    queries = make_vectors(args.queries, args.dim, args.clusters, rng)
+
+    # Verdad de referencia: búsqueda exacta sobre float32
+    base = "bench_float32"
+    load(client, base, data, CONFIGS["float32"], args.batch)
+    exact = [set(search_ids(client, base, q, args.k, rest.SearchParams(exact=True))) for q in queries]
+
+    print(f"points={args.points} dim={args.dim} queries={args.queries} k={args.k} ef={args.ef}\n")
+    print("| config | oversampling | rescore | recall@k | p50 ms | p95 ms | RAM MB (est.) |")
+    print("|---|---|---|---|---|---|---|")
+    for label in args.configs:
+        cfg = CONFIGS[label]
+        name = f"bench_{label.replace('+', '_')}"
+        if name != base:
+            load(client, name, data, cfg, args.batch)
+        variants = [(None, None)] if cfg["quantization"] is None else \
+            [(o, r) for o in args.oversampling for r in (False, True)]
+        for oversampling, rescore in variants:
+            params = rest.SearchParams(hnsw_ef=args.ef, quantization=None if rescore is None else
+                                       rest.QuantizationSearchParams(rescore=rescore, oversampling=oversampling))
+            latencies, hits = [], 0
+            for q, truth in zip(queries, exact):
+                t0 = time.perf_counter()
+                ids = search_ids(client, name, q, args.k, params)
+                latencies.append((time.perf_counter() - t0) * 1000)
+                hits += len(truth.intersection(ids))
+            print(f"| {label} | {oversampling or '-'} | {'-' if rescore is None else rescore} "
+                  f"| {hits / (args.k * len(queries)):.3f} | {statistics.median(latencies):.2f} "
+                  f"| {percentile(latencies, 95):.2f} "
+                  f"| {ram_bytes(args.points, args.dim, cfg['quantization'], cfg['on_disk']) / 2**20:.1f} |")
+        if not args.keep and name != base:
+            client.delete_collection(name)
+    if not args.keep:
+        client.delete_collection(base)
+
+if __name__ == "__main__":
+    main()
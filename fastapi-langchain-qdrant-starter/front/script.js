@@ -69,6 +69,37 @@
     return sessionId;
   }
 
+  function renderSources(el, sources) {
+    if (!sources || !sources.length) return;
+    el.innerHTML = sources.map(s => {
+      const name = (s.source || "fuente").toString().split("/").pop();
+      return `<a href="#" title="${s.source}">${name}</a>`;
+    }).join(" · ");
+  }
+
+  async function readEvents(resp, onEvent) {
+    const reader = resp.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      let sep;
+      while ((sep = buffer.indexOf("\n\n")) !== -1) {
+        const raw = buffer.slice(0, sep);
+        buffer = buffer.slice(sep + 2);
+        let event = "message";
+        let data = "";
+        for (const line of raw.split("\n")) {
+          if (line.startsWith("event:")) event = line.slice(6).trim();
+          else if (line.startsWith("data:")) data += line.slice(5).trim();
+        }
+        if (data) onEvent(event, JSON.parse(data));
+      }
+    }
+  }
+
   async function sendMessage() {
     const text = input.value.trim();
     if (!text) return;
@@ -85,7 +116,7 @@
 
     try {
       await ensureSession();
-      const resp = await fetch(`${API_BASE}/chat`, {
+      const resp = await fetch(`${API_BASE}/chat/stream`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({ session_id: sessionId, message: text, k: 4 })
@@ -94,20 +125,26 @@
         const errText = await resp.text();
         throw new Error(`${resp.status} ${errText}`);
       }
-      const data = await resp.json();
-      // Replace typing bubble with final content
-      typingBubble.textContent = data.reply || "(sin respuesta)";
-      typingBubble.classList.remove("loading");
-
-      // Render sources
       const sourcesWraps = chat.querySelectorAll(".msg.assistant .sources");
       const lastSources = sourcesWraps[sourcesWraps.length - 1];
-      if (data.sources && data.sources.length) {
-        lastSources.innerHTML = data.sources.map(s => {
-          const name = (s.source || "fuente").toString().split("/").pop();
-          return `<a href="#" title="${s.source}">${name}</a>`;
-        }).join(" · ");
-      }
+      let reply = "";
+
+      // Server-Sent Events: "sources", luego "token"s y al final "done" o "error"
+      await readEvents(resp, (event, data) => {
+        if (event === "sources") {
+          renderSources(lastSources, data.sources);
+        } else if (event === "token") {
+          if (!reply) typingBubble.classList.remove("loading");
+          reply += data.token;
+          typingBubble.textContent = reply;
+          chat.scrollTop = chat.scrollHeight;
+        } else if (event === "done") {
+          typingBubble.textContent = data.reply || "(sin respuesta)";
+        } else if (event === "error") {
+          throw new Error(data.detail);
+        }
+      });
+      typingBubble.classList.remove("loading");
     } catch (e) {
       typingBubble.textContent = `Error: ${e.message}`;
       typingBubble.classList.remove("loading");